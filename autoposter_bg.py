@@ -1,11 +1,24 @@
-from atproto import Client
+from atproto import Client, Request
 import os
 import re
 import time
 import json
 import sys
+import random
+import contextlib
+import copy
+import multiprocessing
+import signal
+import sqlite3
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from functools import partial
+from urllib.parse import urlencode
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, List, Set, Tuple
+from typing import Optional, Container, Dict, Iterable, Iterator, List, MutableMapping, NamedTuple, Set, Tuple
 
 # Github Actions: print direct
 try:
@@ -18,6 +31,7 @@ print("=== BEAUTYGROUP BOT STARTED ===", flush=True)
 # ============================================================
 # FEEDS
 # leeg = skip
+# "chronological": False voor feeds die niet op tijd gesorteerd zijn
 # ============================================================
 
 FEEDS = {
@@ -88,12 +102,109 @@ LIST_MEMBER_LIMIT = int(os.getenv("LIST_MEMBER_LIMIT", "1500"))
 MAX_PER_RUN = int(os.getenv("MAX_PER_RUN", "100"))
 MAX_PER_USER = int(os.getenv("MAX_PER_USER", "2"))
 HOURS_BACK = int(os.getenv("HOURS_BACK", "2"))
-SLEEP_SECONDS = float(os.getenv("SLEEP_SECONDS", "1"))
+
+# rate limiting: token buckets voor reads (queries) en writes (procedures, per operatie)
+# PDS: 5000 punten/uur, create = 3 punten -> ~0.46 creates/sec
+READ_RATE = float(os.getenv("READ_RATE", "10"))
+READ_BURST = float(os.getenv("READ_BURST", "50"))
+WRITE_RATE = float(os.getenv("WRITE_RATE", "0.46"))
+WRITE_BURST = float(os.getenv("WRITE_BURST", "250"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "4"))
+# timeout per API call (seconden, 0 = standaard van de client)
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "20"))
+
+# harde deadline per run (0 = geen); bij DEADLINE_RESERVE_SECONDS resterend stopt het ophalen,
+# de rest van de tijd is voor posten wat er al is en het opslaan van de state
+RUN_DEADLINE_MINUTES = float(os.getenv("RUN_DEADLINE_MINUTES", "0"))
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", "120"))
+
+# handle -> DID / at:// URI resolutie cachen in de state
+RESOLVE_CACHE_TTL_HOURS = float(os.getenv("RESOLVE_CACHE_TTL_HOURS", "168"))
+RESOLVE_REFRESH = os.getenv("RESOLVE_REFRESH", "0").strip() in ("1", "true", "yes")
+
+# exclude lijsten cachen; verouderde cache wordt gebruikt en op de achtergrond ververst
+EXCLUDE_REFRESH_HOURS = float(os.getenv("EXCLUDE_REFRESH_HOURS", "6"))
+
+# repost/like records ouder dan dit worden uit de state verwijderd (nooit korter dan HOURS_BACK)
+RECORD_RETENTION_HOURS = float(os.getenv("RECORD_RETENTION_HOURS", "72"))
+
+# repost/like records herbouwen uit de eigen repo (listRecords) tot RECONCILE_HOURS terug
+# auto = alleen als de state geen records heeft (nieuwe runner / state kwijt), 1 = elke run, 0 = nooit
+RECONCILE = os.getenv("RECONCILE", "auto").strip().lower()
+RECONCILE_HOURS = max(HOURS_BACK, float(os.getenv("RECONCILE_HOURS", str(HOURS_BACK))))
+
+# meerdere groepen in één proces: python autoposter_bg.py --config groups.json
+CONFIG_FILE = os.getenv("CONFIG_FILE", "").strip()
+
+# stream mode (python autoposter_bg.py --stream): Jetstream i.p.v. pollen
+# daemon mode (python autoposter_bg.py --daemon): zelf pollen elke DAEMON_INTERVAL_MINUTES, warme caches
+RUN_MODE = os.getenv("RUN_MODE", "once").strip().lower()
+DAEMON_INTERVAL_MINUTES = float(os.getenv("DAEMON_INTERVAL_MINUTES", "30"))
+JETSTREAM_URL = os.getenv("JETSTREAM_URL", "wss://jetstream2.us-east.bsky.network/subscribe")
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "60"))
+# MAX_PER_RUN en MAX_PER_USER gelden in stream mode per venster van zoveel minuten (zoals één poll run)
+STREAM_WINDOW_MINUTES = float(os.getenv("STREAM_WINDOW_MINUTES", "30"))
+JETSTREAM_MAX_DIDS = 10000
+
+# promo posts niet opnieuw unrepost/repost'en als de vorige refresh jonger is dan dit (0 = elke run)
+PROMO_REFRESH_MINUTES = float(os.getenv("PROMO_REFRESH_MINUTES", "60"))
+# de refresh valt een paar minuten na de start van de vorige run: zonder marge telt elke 60 min run als te jong
+PROMO_REFRESH_TOLERANCE_MINUTES = float(os.getenv("PROMO_REFRESH_TOLERANCE_MINUTES", "5"))
+
+# stoppen met ophalen zodra het budget van MAX_PER_RUN gevuld is
+EARLY_STOP = os.getenv("EARLY_STOP", "1").strip() not in ("0", "false", "no", "")
+
+# reposts/likes/promo deletes bundelen via com.atproto.repo.applyWrites
+BATCH_WRITES = os.getenv("BATCH_WRITES", "1").strip() not in ("0", "false", "no", "")
+# PDS limiet is 200 operaties per applyWrites call
+WRITE_BATCH_SIZE = min(200, max(4, int(os.getenv("WRITE_BATCH_SIZE", "200"))))
 
 STATE_FILE = os.getenv("STATE_FILE", "state_beautygroup.json")
+# json   -> alles in STATE_FILE, volledig herschreven per run (standaard)
+# sqlite -> <STATE_FILE zonder extensie>.sqlite, records direct weggeschreven per repost/like
+# log    -> records als append-only <STATE_FILE>.records.log, rest in STATE_FILE
+STATE_BACKEND = os.getenv("STATE_BACKEND", "json").strip().lower()
+# opgeslagen sessie (bevat tokens: niet committen of cachen!), leeg = altijd met wachtwoord inloggen
+# alleen voor lokale runs en daemon mode; in GitHub Actions standaard uit
+SESSION_FILE = os.getenv(
+    "SESSION_FILE", "" if os.getenv("GITHUB_ACTIONS") else os.path.splitext(STATE_FILE)[0] + ".session"
+).strip()
+# run report (JSON) en optioneel een Prometheus textfile; leeg = uit
+RUN_REPORT_FILE = os.getenv("RUN_REPORT_FILE", os.path.splitext(STATE_FILE)[0] + ".report.json").strip()
+PROMETHEUS_FILE = os.getenv("PROMETHEUS_FILE", "").strip()
+
 AUTHOR_POSTS_PER_MEMBER = int(os.getenv("AUTHOR_POSTS_PER_MEMBER", "30"))
 FEED_MAX_ITEMS = int(os.getenv("FEED_MAX_ITEMS", "500"))
-HASHTAG_MAX_ITEMS = int(os.getenv("HASHTAG_MAX_ITEMS", "100"))
+# standaard voor feeds zonder "chronological" key
+FEED_CHRONOLOGICAL = os.getenv("FEED_CHRONOLOGICAL", "1").strip() not in ("0", "false", "no", "")
+# max per hashtag per run; door de since-watermark wordt meestal veel minder opgehaald
+HASHTAG_MAX_ITEMS = int(os.getenv("HASHTAG_MAX_ITEMS", "500"))
+
+# aantal parallelle author-feed fetches per lijst (1 = serieel)
+AUTHOR_FEED_WORKERS = max(1, int(os.getenv("AUTHOR_FEED_WORKERS", "8")))
+# leden verdelen over N processen (hash van de DID), elk met AUTHOR_FEED_WORKERS threads (1 = uit)
+LIST_WORKER_PROCESSES = max(1, int(os.getenv("LIST_WORKER_PROCESSES", "1")))
+
+# LIST_MODE=members  -> author feed per lid (oud gedrag)
+# LIST_MODE=listfeed -> app.bsky.feed.getListFeed, pagineren tot de cutoff
+LIST_MODE = os.getenv("LIST_MODE", "members").strip().lower()
+LIST_FEED_MAX_ITEMS = int(os.getenv("LIST_FEED_MAX_ITEMS", "1000"))
+
+# alleen author feeds ophalen van leden waarvan postsCount veranderd is (getProfiles, 25 per call)
+AUTHOR_PRECHECK = os.getenv("AUTHOR_PRECHECK", "1").strip() not in ("0", "false", "no", "")
+PROFILES_BATCH_SIZE = 25
+
+# adaptief pollen: max aantal leden per run (0 = iedereen elke run), meest achterstallige eerst
+AUTHOR_POLL_BUDGET = int(os.getenv("AUTHOR_POLL_BUDGET", "0"))
+# volgende poll = tijd sinds laatste post * factor, nooit later dan de max gap
+AUTHOR_POLL_BACKOFF = float(os.getenv("AUTHOR_POLL_BACKOFF", "0.5"))
+# een lid wordt pas de eerstvolgende run na zijn poll tijd opgehaald: slack = tijd tussen runs (+ cron vertraging)
+AUTHOR_POLL_SLACK_MINUTES = float(os.getenv("AUTHOR_POLL_SLACK_MINUTES", "30"))
+# max gap + slack blijft binnen HOURS_BACK, anders vallen posts buiten de cutoff
+AUTHOR_MAX_POLL_GAP_HOURS = max(
+    0.0,
+    min(float(os.getenv("AUTHOR_MAX_POLL_GAP_HOURS", str(HOURS_BACK))), HOURS_BACK - AUTHOR_POLL_SLACK_MINUTES / 60),
+)
 
 # secrets blijven zoals je oude bot
 ENV_USERNAME = "BSKY_USERNAME_BG"
@@ -113,6 +224,354 @@ def utcnow() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class RunStats:
+    """Per-run stage timings, API call metrics and candidate funnel counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = utcnow()
+        self.stages: Dict[str, float] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.retries: Dict[str, int] = {}
+        self.funnel: Dict[str, int] = {}
+        self.skipped: List[Dict] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - t0)
+
+    def add_stage_time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_call(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def record_retry(self, endpoint: str) -> None:
+        with self.lock:
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.funnel[key] = self.funnel.get(key, 0) + n
+
+    def add_funnel(self, counts: Dict[str, int]) -> None:
+        with self.lock:
+            for k, v in counts.items():
+                self.funnel[k] = self.funnel.get(k, 0) + v
+
+    def take_calls(self) -> Tuple[Dict, Dict, Dict]:
+        """Call metrics recorded so far, then cleared; shard workers send these to the parent."""
+        with self.lock:
+            calls = (self.latencies, self.errors, self.retries)
+            self.latencies, self.errors, self.retries = {}, {}, {}
+        return calls
+
+    def merge_calls(self, calls: Tuple[Dict, Dict, Dict]) -> None:
+        latencies, errors, retries = calls
+        with self.lock:
+            for ep, lat in latencies.items():
+                self.latencies.setdefault(ep, []).extend(lat)
+            for ep, n in errors.items():
+                self.errors[ep] = self.errors.get(ep, 0) + n
+            for ep, n in retries.items():
+                self.retries[ep] = self.retries.get(ep, 0) + n
+
+    def skip_source(self, name: str, partial: bool) -> None:
+        with self.lock:
+            self.skipped.append({"source": name, "partial": partial})
+
+    def report(self, **extra) -> Dict:
+        with self.lock:
+            endpoints = {
+                ep: {
+                    "calls": len(lat),
+                    "errors": self.errors.get(ep, 0),
+                    "retries": self.retries.get(ep, 0),
+                    "p50_ms": round(percentile(lat, 50) * 1000, 1),
+                    "p95_ms": round(percentile(lat, 95) * 1000, 1),
+                }
+                for ep, lat in sorted(self.latencies.items())
+            }
+            out = {
+                "started": self.started.isoformat(),
+                "finished": utcnow().isoformat(),
+                "stages_s": {k: round(v, 3) for k, v in self.stages.items()},
+                "api": endpoints,
+                "api_calls_total": sum(e["calls"] for e in endpoints.values()),
+                "funnel": dict(sorted(self.funnel.items())),
+                "skipped_sources": list(self.skipped),
+            }
+        out.update(extra)
+        return out
+
+
+STATS = RunStats()
+
+
+class DeadlineExceeded(Exception):
+    """A rate limit wait would run past the run deadline."""
+
+
+class RunDeadline:
+    """Wall-clock budget of one run (RUN_DEADLINE_MINUTES)."""
+
+    def __init__(self):
+        self.ends: Optional[float] = None
+        self.stopped: Set[str] = set()
+
+    def start(self, minutes: float) -> None:
+        self.ends = time.monotonic() + minutes * 60 if minutes > 0 else None
+        self.stopped = set()
+
+    def remaining(self) -> float:
+        return self.ends - time.monotonic() if self.ends is not None else float("inf")
+
+    def allow_wait(self, kind: str, seconds: float) -> bool:
+        """False when sleeping that long would pass the point where kind has to stop.
+
+        Reads stop DEADLINE_RESERVE_SECONDS before the deadline, writes at the deadline;
+        a refused wait stops that kind for the rest of the run.
+        """
+        limit = self.remaining() - (DEADLINE_RESERVE_SECONDS if kind == "read" else 0.0)
+        if seconds <= limit:
+            return True
+        self.stopped.add(kind)
+        return False
+
+    def near(self) -> bool:
+        """True once only DEADLINE_RESERVE_SECONDS are left: stop fetching, post and save."""
+        return "read" in self.stopped or self.remaining() <= DEADLINE_RESERVE_SECONDS
+
+    def expired(self) -> bool:
+        return "write" in self.stopped or self.remaining() <= 0
+
+
+DEADLINE = RunDeadline()
+
+
+def write_run_report(report: Dict, path: str, prom_path: str) -> None:
+    if path:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    if prom_path:
+        lines = [
+            "# TYPE beautygroup_stage_seconds gauge",
+            *[f'beautygroup_stage_seconds{{stage="{k}"}} {v}' for k, v in report["stages_s"].items()],
+            "# TYPE beautygroup_api_calls gauge",
+            *[f'beautygroup_api_calls{{endpoint="{k}"}} {v["calls"]}' for k, v in report["api"].items()],
+            "# TYPE beautygroup_api_errors gauge",
+            *[f'beautygroup_api_errors{{endpoint="{k}"}} {v["errors"]}' for k, v in report["api"].items()],
+            "# TYPE beautygroup_api_retries gauge",
+            *[f'beautygroup_api_retries{{endpoint="{k}"}} {v["retries"]}' for k, v in report["api"].items()],
+            "# TYPE beautygroup_api_latency_ms gauge",
+            *[
+                f'beautygroup_api_latency_ms{{endpoint="{k}",quantile="{q}"}} {v[f"p{q}_ms"]}'
+                for k, v in report["api"].items()
+                for q in (50, 95)
+            ],
+            "# TYPE beautygroup_skipped_sources gauge",
+            f"beautygroup_skipped_sources {len(report.get('skipped_sources', []))}",
+            "# TYPE beautygroup_funnel gauge",
+            *[f'beautygroup_funnel{{step="{k}"}} {v}' for k, v in report["funnel"].items()],
+            "# TYPE beautygroup_last_run_timestamp gauge",
+            f"beautygroup_last_run_timestamp {int(time.time())}",
+        ]
+        tmp = prom_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, prom_path)
+
+
+def timed_source(stage: str, name: str, source: Iterator["Candidate"]) -> Iterator["Candidate"]:
+    """Charge the time spent inside a source generator to stage; stops the source near the deadline."""
+    started = False
+    while True:
+        if DEADLINE.near():
+            log(f"⏰ Run deadline near, skip {name}")
+            STATS.skip_source(name, started)
+            source.close()
+            return
+        started = True
+        t0 = time.perf_counter()
+        try:
+            c = next(source)
+        except StopIteration:
+            STATS.add_stage_time(stage, time.perf_counter() - t0)
+            return
+        STATS.add_stage_time(stage, time.perf_counter() - t0)
+        yield c
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float) -> float:
+        """Take cost tokens, return how long the caller has to wait for them."""
+        now = time.monotonic()
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        self.tokens -= cost
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+
+class RateLimiter:
+    """Separate read/write buckets, tightened by the server's RateLimit-* headers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {
+            "read": TokenBucket(READ_RATE, READ_BURST),
+            "write": TokenBucket(WRITE_RATE, WRITE_BURST),
+        }
+        self.retries = 0
+
+    def acquire(self, kind: str, cost: float = 1.0) -> None:
+        with self.lock:
+            wait = self.buckets[kind].reserve(cost)
+        if wait > 0:
+            if not DEADLINE.allow_wait(kind, wait):
+                with self.lock:
+                    self.buckets[kind].tokens += min(cost, self.buckets[kind].capacity)
+                raise DeadlineExceeded(f"{kind} rate limit wait of {wait:.0f}s runs past the run deadline")
+            time.sleep(wait)
+
+    def update_from_headers(self, kind: str, headers) -> None:
+        if not headers:
+            return
+        try:
+            remaining = headers.get("ratelimit-remaining")
+            reset = headers.get("ratelimit-reset")
+        except Exception:
+            return
+        if remaining is None:
+            return
+        try:
+            remaining_f = float(remaining)
+            reset_at = float(reset) if reset is not None else 0.0
+        except ValueError:
+            return
+        bucket = self.buckets[kind]
+        with self.lock:
+            bucket._refill(time.monotonic())
+            bucket.tokens = min(bucket.tokens, remaining_f)
+            if remaining_f <= 0 and reset_at:
+                bucket.blocked_until = time.monotonic() + max(0.0, reset_at - time.time())
+
+    def backoff(self, kind: str, attempt: int, headers=None) -> float:
+        """Seconds to wait before retrying; honours ratelimit-reset / retry-after when present."""
+        wait = min(60.0, (2 ** attempt) + random.random())
+        try:
+            if headers and headers.get("ratelimit-reset"):
+                wait = max(wait, float(headers.get("ratelimit-reset")) - time.time())
+            elif headers and headers.get("retry-after"):
+                wait = max(wait, float(headers.get("retry-after")))
+        except (TypeError, ValueError):
+            pass
+        with self.lock:
+            self.retries += 1
+            bucket = self.buckets[kind]
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + wait)
+        return wait
+
+
+def shared_limit_endpoint(kind: str, endpoint: str) -> bool:
+    """Whether the RateLimit-* headers of endpoint describe the shared read/write budget.
+
+    Auth endpoints (createSession: 30 per 5 min) report their own per-endpoint limit;
+    for writes only the repo endpoints count against the PDS write points.
+    """
+    if endpoint.startswith("com.atproto.server."):
+        return False
+    return kind == "read" or endpoint.startswith("com.atproto.repo.")
+
+
+class BotClient(Client):
+    """Client that sends every XRPC call through the RateLimiter and retries 429/5xx."""
+
+    def __init__(self, limiter: RateLimiter, *args, **kwargs):
+        self.limiter = limiter
+        # timeout per call; Request geeft zijn kwargs door aan httpx
+        if "request" not in kwargs and REQUEST_TIMEOUT_SECONDS > 0:
+            kwargs["request"] = Request(timeout=REQUEST_TIMEOUT_SECONDS)
+        super().__init__(*args, **kwargs)
+
+    def _invoke(self, invoke_type, **kwargs):
+        kind = "write" if getattr(invoke_type, "value", invoke_type) == "procedure" else "read"
+        cost = 1.0
+        # applyWrites: een token per operatie; data is een dict of een pydantic Data model
+        data = kwargs.get("data")
+        writes = data.get("writes") if isinstance(data, dict) else getattr(data, "writes", None)
+        if kind == "write" and isinstance(writes, list):
+            cost = float(max(1, len(writes)))
+
+        url = str(kwargs.get("url") or "")
+        endpoint = url.rsplit("/xrpc/", 1)[-1] if "/xrpc/" in url else url or kind
+        # andere limieten (login) niet op de gedeelde bucket toepassen
+        shared = shared_limit_endpoint(kind, endpoint)
+
+        attempt = 0
+        while True:
+            self.limiter.acquire(kind, cost)
+            t0 = time.perf_counter()
+            try:
+                response = super()._invoke(invoke_type, **kwargs)
+                STATS.record_call(endpoint, time.perf_counter() - t0, True)
+            except Exception as e:
+                STATS.record_call(endpoint, time.perf_counter() - t0, False)
+                resp = getattr(e, "response", None)
+                status = getattr(resp, "status_code", None)
+                # writes alleen bij 429: na een timeout of 5xx (502/504) kan de PDS ze al verwerkt hebben
+                if kind == "write":
+                    retryable = status == 429
+                else:
+                    retryable = status is None or status == 429 or status >= 500
+                # vlak voor de deadline geen reads meer herhalen, writes wel
+                if not retryable or attempt >= MAX_RETRIES or (kind == "read" and DEADLINE.near()):
+                    raise
+                headers = getattr(resp, "headers", None) if shared else None
+                wait = self.limiter.backoff(kind, attempt, headers)
+                STATS.record_retry(endpoint)
+                log(f"⏳ {kind} call failed ({status or type(e).__name__}), retry {attempt + 1} in {wait:.1f}s")
+                attempt += 1
+                continue
+            if shared:
+                self.limiter.update_from_headers(kind, getattr(response, "headers", None))
+            return response
+
+
 def parse_time(post) -> Optional[datetime]:
     indexed = getattr(post, "indexedAt", None) or getattr(post, "indexed_at", None)
     if indexed:
@@ -207,28 +666,404 @@ def normalize_list_uri(client: Client, s: str) -> Optional[str]:
     return f"at://{did}/app.bsky.graph.list/{rkey}"
 
 
+def cached_normalize(client: Client, link: str, normalize, cache: Dict[str, Dict]) -> Optional[str]:
+    """normalize(client, link) with a TTL cache keyed by the config link.
+
+    A stale entry is still used when re-resolving fails.
+    """
+    entry = cache.get(link)
+    if entry and not RESOLVE_REFRESH:
+        try:
+            age = utcnow() - datetime.fromisoformat(entry["at"])
+            if age < timedelta(hours=RESOLVE_CACHE_TTL_HOURS):
+                return entry["uri"]
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    uri = normalize(client, link)
+    if uri:
+        cache[link] = {"uri": uri, "at": utcnow().isoformat()}
+        return uri
+    if entry and entry.get("uri"):
+        log(f"⚠️ Resolve failed, using cached URI for {link}")
+        return entry["uri"]
+    return None
+
+
+def invalidate_resolution(cache: Dict[str, Dict], uri: str) -> None:
+    """Drop cache entries pointing at uri, so the next run resolves them again."""
+    for link in [k for k, v in cache.items() if isinstance(v, dict) and v.get("uri") == uri]:
+        cache.pop(link, None)
+
+
+def empty_state() -> Dict:
+    return {
+        "repost_records": {},
+        "like_records": {},
+        "author_watermarks": {},
+        "feed_watermarks": {},
+        "hashtag_watermarks": {},
+        "resolve_cache": {},
+        "exclude_cache": {},
+        "promo_seen": {},
+        "author_schedule": {},
+    }
+
+
 def load_state(path: str) -> Dict:
     if not os.path.exists(path):
-        return {"repost_records": {}, "like_records": {}}
+        return empty_state()
     try:
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
         if not isinstance(data, dict):
-            return {"repost_records": {}, "like_records": {}}
-        data.setdefault("repost_records", {})
-        data.setdefault("like_records", {})
+            return empty_state()
+        for k, v in empty_state().items():
+            data.setdefault(k, v)
         return data
     except Exception:
-        return {"repost_records": {}, "like_records": {}}
+        return empty_state()
+
+
+TID_CHARS = "234567abcdefghijklmnopqrstuvwxyz"
+_last_tid = 0
+
+
+def next_tid() -> str:
+    """Record key in atproto TID format (microsecond timestamp + clock id), strictly increasing."""
+    global _last_tid
+    v = max(int(time.time() * 1_000_000) << 10, _last_tid + 1)
+    _last_tid = v
+    out = ""
+    for _ in range(13):
+        out = TID_CHARS[v & 31] + out
+        v >>= 5
+    return out
+
+
+def tid_time(rkey: str) -> Optional[datetime]:
+    """Creation time encoded in a TID record key, None if rkey is not a TID."""
+    if len(rkey) != 13:
+        return None
+    v = 0
+    for ch in rkey:
+        i = TID_CHARS.find(ch)
+        if i < 0:
+            return None
+        v = (v << 5) | i
+    try:
+        return datetime.fromtimestamp((v >> 10) / 1_000_000, tz=timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def prune_state(state: Dict, horizon: datetime) -> int:
+    """Drop repost/like records created before horizon. Subjects still seen as promo keep theirs."""
+    promo_seen: Dict[str, str] = state["promo_seen"]
+    for uri in [u for u, t in promo_seen.items() if not isinstance(t, str) or t < horizon.isoformat()]:
+        promo_seen.pop(uri, None)
+
+    # leden die al sinds de horizon niet meer gepland zijn (van de lijst af); terugkomers zijn meteen due
+    schedule: Dict[str, List[float]] = state["author_schedule"]
+    for actor in [a for a, v in schedule.items() if not isinstance(v, list) or v[0] < horizon.timestamp()]:
+        schedule.pop(actor, None)
+
+    removed = 0
+    for key in ("repost_records", "like_records"):
+        records: MutableMapping[str, str] = state[key]
+        if isinstance(records, SqliteRecords):
+            removed += records.prune(horizon, promo_seen)
+            continue
+        for subject_uri, record_uri in list(records.items()):
+            if subject_uri in promo_seen:
+                continue
+            parsed = parse_at_uri_rkey(record_uri)
+            created = tid_time(parsed[2]) if parsed else None
+            if created and created < horizon:
+                records.pop(subject_uri, None)
+                removed += 1
+    return removed
 
 
 def save_state(path: str, state: Dict) -> None:
     tmp = path + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+        json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
     os.replace(tmp, path)
 
 
+RECORD_KEYS = ("repost_records", "like_records")
+
+
+class JsonStateStore:
+    """Whole state in one JSON file, rewritten on save."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict:
+        return load_state(self.path)
+
+    def save(self, state: Dict) -> None:
+        save_state(self.path, {k: dict(v) if k in RECORD_KEYS else v for k, v in state.items()})
+
+    def compact(self, state: Dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def record_created_ts(record_uri: str) -> Optional[float]:
+    """Creation time (epoch seconds) from the TID record key, None for other keys."""
+    parsed = parse_at_uri_rkey(record_uri)
+    created = tid_time(parsed[2]) if parsed else None
+    return created.timestamp() if created else None
+
+
+class SqliteRecords(MutableMapping):
+    """subject_uri -> record_uri for one kind, every change committed immediately.
+
+    The creation time from the record key is stored as a column, so pruning and
+    reconcile only read the rows in their time range.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, kind: str):
+        self.conn = conn
+        self.kind = kind
+        self.deleted = 0
+
+    def __getitem__(self, subject: str) -> str:
+        row = self.conn.execute(
+            "SELECT uri FROM records WHERE kind = ? AND subject = ?", (self.kind, subject)
+        ).fetchone()
+        if row is None:
+            raise KeyError(subject)
+        return row[0]
+
+    def __setitem__(self, subject: str, uri: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO records (kind, subject, uri, created) VALUES (?, ?, ?, ?)",
+                (self.kind, subject, uri, record_created_ts(uri)),
+            )
+
+    def __delitem__(self, subject: str) -> None:
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM records WHERE kind = ? AND subject = ?", (self.kind, subject))
+        if cur.rowcount == 0:
+            raise KeyError(subject)
+        self.deleted += 1
+
+    def __iter__(self):
+        rows = self.conn.execute("SELECT subject FROM records WHERE kind = ?", (self.kind,)).fetchall()
+        return iter([r[0] for r in rows])
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM records WHERE kind = ?", (self.kind,)).fetchone()[0]
+
+    def prune(self, horizon: datetime, keep: Container[str]) -> int:
+        """Delete records created before horizon, except subjects in keep, in one transaction."""
+        rows = self.conn.execute(
+            "SELECT subject FROM records WHERE kind = ? AND created < ?", (self.kind, horizon.timestamp())
+        ).fetchall()
+        subjects = [(self.kind, r[0]) for r in rows if r[0] not in keep]
+        with self.conn:
+            self.conn.executemany("DELETE FROM records WHERE kind = ? AND subject = ?", subjects)
+        self.deleted += len(subjects)
+        return len(subjects)
+
+    def created_since(self, since: datetime) -> List[Tuple[str, str]]:
+        """(subject, record uri) for records created at or after since."""
+        return self.conn.execute(
+            "SELECT subject, uri FROM records WHERE kind = ? AND created >= ?", (self.kind, since.timestamp())
+        ).fetchall()
+
+
+class SqliteStateStore:
+    """Records in an indexed table, everything else as JSON values in a meta table.
+
+    An existing JSON state file is imported on first use.
+    """
+
+    def __init__(self, path: str, json_path: Optional[str] = None):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "kind TEXT NOT NULL, subject TEXT NOT NULL, uri TEXT NOT NULL, created REAL, PRIMARY KEY (kind, subject)"
+            ") WITHOUT ROWID"
+        )
+        columns = [r[1] for r in self.conn.execute("PRAGMA table_info(records)")]
+        if "created" not in columns:
+            # oudere database: kolom toevoegen en vullen uit de record keys
+            self.conn.execute("ALTER TABLE records ADD COLUMN created REAL")
+            rows = self.conn.execute("SELECT kind, subject, uri FROM records").fetchall()
+            self.conn.executemany(
+                "UPDATE records SET created = ? WHERE kind = ? AND subject = ?",
+                [(record_created_ts(u), k, s) for k, s, u in rows],
+            )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_created ON records (kind, created)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+        self.json_path = json_path
+
+    def load(self) -> Dict:
+        state = empty_state()
+        rows = self.conn.execute("SELECT key, value FROM meta").fetchall()
+        if not rows and self.json_path and os.path.exists(self.json_path):
+            log(f"📦 Importing {self.json_path} into sqlite state")
+            legacy = load_state(self.json_path)
+            with self.conn:
+                for key, kind in zip(RECORD_KEYS, ("repost", "like")):
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO records (kind, subject, uri, created) VALUES (?, ?, ?, ?)",
+                        [(kind, s, u, record_created_ts(u)) for s, u in legacy.get(key, {}).items()],
+                    )
+            state.update({k: v for k, v in legacy.items() if k not in RECORD_KEYS})
+        for key, value in rows:
+            try:
+                state[key] = json.loads(value)
+            except ValueError:
+                pass
+        state["repost_records"] = SqliteRecords(self.conn, "repost")
+        state["like_records"] = SqliteRecords(self.conn, "like")
+        return state
+
+    def save(self, state: Dict) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [
+                    (k, json.dumps(v, ensure_ascii=False, separators=(",", ":")))
+                    for k, v in state.items()
+                    if k not in RECORD_KEYS
+                ],
+            )
+        if state["repost_records"].deleted + state["like_records"].deleted > 1000:
+            self.compact(state)
+
+    def compact(self, state: Dict) -> None:
+        self.conn.execute("VACUUM")
+        for key in RECORD_KEYS:
+            state[key].deleted = 0
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class LoggedRecords(MutableMapping):
+    """In-memory records that append every change to a shared log file."""
+
+    def __init__(self, data: Dict[str, str], kind: str, store: "LogStateStore"):
+        self.data = data
+        self.kind = kind
+        self.store = store
+
+    @property
+    def logfile(self):
+        return self.store.logfile
+
+    def _append(self, entry: Dict) -> None:
+        entry["k"] = self.kind
+        self.logfile.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.logfile.flush()
+        self.store.lines += 1
+
+    def __getitem__(self, subject: str) -> str:
+        return self.data[subject]
+
+    def __setitem__(self, subject: str, uri: str) -> None:
+        self.data[subject] = uri
+        self._append({"s": subject, "u": uri})
+
+    def __delitem__(self, subject: str) -> None:
+        del self.data[subject]
+        self._append({"s": subject, "d": 1})
+
+    def __iter__(self):
+        return iter(list(self.data))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class LogStateStore:
+    """Records as an append-only log replayed on load; the rest stays in the JSON state file.
+
+    The log is rewritten (compacted) once it holds more than twice the live entries.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.log_path = path + ".records.log"
+        self.lines = 0
+        self.logfile = None
+
+    def load(self) -> Dict:
+        state = load_state(self.path)
+        data: Dict[str, Dict[str, str]] = {"repost": {}, "like": {}}
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # half geschreven regel na een crash
+                    self.lines += 1
+                    records = data.get(entry.get("k"))
+                    if records is None:
+                        continue
+                    if entry.get("d"):
+                        records.pop(entry.get("s"), None)
+                    else:
+                        records[entry.get("s")] = entry.get("u")
+        else:
+            # eerste keer: records uit de JSON state overnemen
+            data["repost"] = dict(state.get("repost_records", {}))
+            data["like"] = dict(state.get("like_records", {}))
+        if self.lines == 0:
+            self._rewrite(data)
+        else:
+            self.logfile = open(self.log_path, "a", encoding="utf-8")
+        state["repost_records"] = LoggedRecords(data["repost"], "repost", self)
+        state["like_records"] = LoggedRecords(data["like"], "like", self)
+        return state
+
+    def _rewrite(self, data: Dict[str, Dict[str, str]]) -> None:
+        tmp = self.log_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for kind, records in data.items():
+                for s, u in records.items():
+                    f.write(json.dumps({"k": kind, "s": s, "u": u}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        if self.logfile:
+            self.logfile.close()
+        os.replace(tmp, self.log_path)
+        self.logfile = open(self.log_path, "a", encoding="utf-8")
+        self.lines = sum(len(r) for r in data.values())
+
+    def save(self, state: Dict) -> None:
+        save_state(self.path, {k: v for k, v in state.items() if k not in RECORD_KEYS})
+        live = len(state["repost_records"]) + len(state["like_records"])
+        if self.lines > 2 * max(live, 100):
+            self.compact(state)
+
+    def compact(self, state: Dict) -> None:
+        self._rewrite({"repost": state["repost_records"].data, "like": state["like_records"].data})
+
+    def close(self) -> None:
+        if self.logfile:
+            self.logfile.close()
+            self.logfile = None
+
+
+def open_state_store(path: str, backend: str):
+    if backend == "sqlite":
+        return SqliteStateStore(os.path.splitext(path)[0] + ".sqlite", json_path=path)
+    if backend == "log":
+        return LogStateStore(path)
+    return JsonStateStore(path)
+
+
 def parse_at_uri_rkey(uri: str) -> Optional[Tuple[str, str, str]]:
     if not uri or not uri.startswith("at://"):
         return None
@@ -238,23 +1073,83 @@ def parse_at_uri_rkey(uri: str) -> Optional[Tuple[str, str, str]]:
     return parts[0], parts[1], parts[2]
 
 
-def fetch_feed_items(client: Client, feed_uri: str, max_items: int) -> List:
-    items: List = []
+class Candidate(NamedTuple):
+    """What selection and the writes need from a post; the post view itself is dropped early."""
+    uri: str
+    cid: str
+    ts: float  # aanmaaktijd als epoch seconden
+    author_key: str
+    promo: bool
+
+
+def fetch_feed_pages(
+    client: Client,
+    feed_uri: str,
+    max_items: int,
+    stop_before: Optional[datetime] = None,
+    chronological: bool = True,
+) -> Iterator[List]:
+    """Page through a feed one page at a time, stopping early once pages fall before stop_before.
+
+    Chronological feeds stop after the first page whose oldest post is older than
+    stop_before; other feeds only stop once a whole page is older.
+    """
+    fetched = 0
     cursor = None
     while True:
         params = {"feed": feed_uri, "limit": 100}
         if cursor:
             params["cursor"] = cursor
         out = client.app.bsky.feed.get_feed(params)
-        batch = getattr(out, "feed", []) or []
-        items.extend(batch)
+        batch = (getattr(out, "feed", []) or [])[:max_items - fetched]
         cursor = getattr(out, "cursor", None)
-        if not cursor or len(items) >= max_items:
+        fetched += len(batch)
+        yield batch
+        if not cursor or not batch or fetched >= max_items:
             break
-    return items[:max_items]
+        if stop_before is not None:
+            times = [parse_time(getattr(it, "post", None)) for it in batch]
+            times = [t for t in times if t]
+            if times and (min(times) if chronological else max(times)) < stop_before:
+                break
 
 
-def fetch_list_members(client: Client, list_uri: str, limit: int) -> List[Tuple[str, str]]:
+def newest_item_time(items: List) -> Optional[datetime]:
+    times = [parse_time(getattr(it, "post", None)) for it in items]
+    times = [t for t in times if t]
+    return max(times) if times else None
+
+
+def fetch_list_feed_pages(client: Client, list_uri: str, cutoff: Optional[datetime], max_items: int) -> Iterator[List]:
+    """Page through a list's merged timeline until a page ends before cutoff (None = no cutoff)."""
+    fetched = 0
+    cursor = None
+    while True:
+        params = {"list": list_uri, "limit": 100}
+        if cursor:
+            params["cursor"] = cursor
+        try:
+            out = client.app.bsky.feed.get_list_feed(params)
+        except Exception as e:
+            log(f"⚠️ get_list_feed failed for {list_uri}: {e}")
+            break
+        batch = (getattr(out, "feed", []) or [])[:max_items - fetched]
+        cursor = getattr(out, "cursor", None)
+        fetched += len(batch)
+        yield batch
+        if not cursor or not batch or fetched >= max_items:
+            break
+        if cutoff is not None:
+            times = [parse_time(getattr(it, "post", None)) for it in batch]
+            times = [t for t in times if t]
+            if times and min(times) < cutoff:
+                break
+
+
+def fetch_list_members(
+    client: Client, list_uri: str, limit: int, partial_ok: bool = True
+) -> Optional[List[Tuple[str, str]]]:
+    """(handle, did) per member; on a get_list error the pages so far, or None when not partial_ok."""
     members: List[Tuple[str, str]] = []
     cursor = None
     while True:
@@ -264,6 +1159,9 @@ def fetch_list_members(client: Client, list_uri: str, limit: int) -> List[Tuple[
         try:
             out = client.app.bsky.graph.get_list(params)
         except Exception as e:
+            if not partial_ok:
+                log(f"⚠️ get_list failed for {list_uri}: {e}")
+                return None
             log(f"⚠️ get_list failed for {list_uri}: {e} (skip this list)")
             return members
 
@@ -285,141 +1183,612 @@ def fetch_list_members(client: Client, list_uri: str, limit: int) -> List[Tuple[
     return members[:limit]
 
 
-def fetch_author_feed(client: Client, actor: str, limit: int) -> List:
+# gedeeld tussen groepen in config mode (actor, limit) -> (kandidaten, funnel); None = geen cache
+AUTHOR_FEED_CACHE: Optional[Dict[Tuple[str, int], Tuple[List[Candidate], Dict[str, int]]]] = None
+
+
+def fetch_author_candidates(client: Client, actor: str, limit: int) -> Tuple[List[Candidate], Dict[str, int]]:
+    """Author feed as candidates without cutoff, oldest first, plus its funnel counts.
+
+    The post views are dropped in the worker; cutoff and promo are applied per group.
+    A failed fetch has "fetch_failed" in its funnel, so no watermark or schedule is stored.
+    """
+    cache = AUTHOR_FEED_CACHE
+    if cache is not None and (actor, limit) in cache:
+        return cache[(actor, limit)]
     try:
         out = client.app.bsky.feed.get_author_feed({"actor": actor, "limit": limit})
-        return getattr(out, "feed", []) or []
-    except Exception:
-        return []
+    except Exception as e:
+        log(f"⚠️ get_author_feed failed for {actor}: {e}")
+        return [], {"fetch_failed": 1}
+    funnel: Dict[str, int] = {}
+    cands = feed_item_candidates(getattr(out, "feed", []) or [], None, set(), set(), False, funnel)
+    cands.sort(key=lambda x: x.ts)
+    if cache is not None:
+        cache[(actor, limit)] = (cands, funnel)
+    return cands, funnel
+
+
+def fetch_author_feeds(
+    client: Client, actors: List[str], limit: int, workers: int
+) -> List[Tuple[List[Candidate], Dict[str, int]]]:
+    """fetch_author_candidates for all actors, results in the same order as actors."""
+    if workers <= 1 or len(actors) <= 1:
+        return [fetch_author_candidates(client, a, limit) for a in actors]
+    with ThreadPoolExecutor(max_workers=min(workers, len(actors))) as pool:
+        return list(pool.map(lambda a: fetch_author_candidates(client, a, limit), actors))
+
+
+# client van een shard worker proces (LIST_WORKER_PROCESSES > 1)
+SHARD_CLIENT: Optional[Client] = None
+
+
+def shard_init(session_string: str, settings: Dict) -> None:
+    """Worker process setup: parent settings, own rate limiter, login with the parent's session."""
+    global SHARD_CLIENT
+    globals().update(settings)
+    SHARD_CLIENT = BotClient(RateLimiter())
+    SHARD_CLIENT.login(session_string=session_string)
+
+
+def shard_fetch(actors: List[str], limit: int) -> Tuple[List[Tuple[List[Candidate], Dict[str, int]]], Tuple]:
+    """Author candidates for one chunk of a shard, plus the call metrics of that work."""
+    results = fetch_author_feeds(SHARD_CLIENT, actors, limit, AUTHOR_FEED_WORKERS)
+    return results, STATS.take_calls()
+
+
+def sharded_author_feeds(
+    client: Client, actors: List[str], limit: int, processes: int, step: int
+) -> Iterator[Tuple[List[str], List[Tuple[List[Candidate], Dict[str, int]]]]]:
+    """Fetch author candidates in worker processes, one shard of actors per process (crc32 of the DID).
+
+    Chunks come back round-robin over the shards; only a few are queued per process,
+    so closing the generator (early stop, deadline) cancels the rest.
+    """
+    shards: List[List[str]] = [[] for _ in range(processes)]
+    for a in actors:
+        shards[zlib.crc32(a.encode()) % processes].append(a)
+    order: List[Tuple[int, List[str]]] = []
+    for j in range(0, max(len(s) for s in shards), step):
+        order.extend((i, s[j:j + step]) for i, s in enumerate(shards) if j < len(s))
+
+    # elk proces krijgt een deel van de read rate; de parent leest zolang niet
+    settings = {
+        "READ_RATE": READ_RATE / processes,
+        "READ_BURST": max(1.0, READ_BURST / processes),
+        "MAX_RETRIES": MAX_RETRIES,
+        "REQUEST_TIMEOUT_SECONDS": REQUEST_TIMEOUT_SECONDS,
+        "AUTHOR_FEED_WORKERS": AUTHOR_FEED_WORKERS,
+    }
+    session = client.export_session_string()
+    # geen fork: de parent heeft threads (exclude refresh, logging) die locks kunnen vasthouden
+    methods = multiprocessing.get_all_start_methods()
+    mp_context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    pools = [
+        ProcessPoolExecutor(max_workers=1, mp_context=mp_context, initializer=shard_init, initargs=(session, settings))
+        for _ in range(processes)
+    ]
+    tasks = iter(order)
+    inflight: deque = deque()
+
+    def submit_next() -> None:
+        task = next(tasks, None)
+        if task is not None:
+            shard, chunk = task
+            try:
+                future = pools[shard].submit(shard_fetch, chunk, limit)
+            except Exception as e:
+                # kapotte pool (worker gecrasht): als mislukt blok afhandelen
+                future = Future()
+                future.set_exception(e)
+            inflight.append((chunk, future))
+
+    timed_out = False
+    try:
+        for _ in range(2 * processes):
+            submit_next()
+        while inflight:
+            chunk, future = inflight.popleft()
+            submit_next()
+            try:
+                # niet langer wachten dan tot het ophalen voor de deadline moet stoppen
+                wait = None if DEADLINE.ends is None else max(0.0, DEADLINE.remaining() - DEADLINE_RESERVE_SECONDS)
+                results, calls = future.result(timeout=wait)
+            except FuturesTimeout:
+                log("⏰ Shard worker did not answer before the run deadline, stopping the shards")
+                timed_out = True
+                return
+            except Exception as e:
+                # fetch_failed per lid: geen watermark/planning, dus volgende run opnieuw
+                log(f"⚠️ Shard worker failed for {len(chunk)} members: {e}")
+                results, calls = [([], {"fetch_failed": 1}) for _ in chunk], ({}, {}, {})
+            STATS.merge_calls(calls)
+            yield chunk, results
+    finally:
+        for pool in pools:
+            if timed_out:
+                # hangende workers stoppen, anders wacht ook het afsluiten van Python op ze
+                for proc in list((getattr(pool, "_processes", None) or {}).values()):
+                    proc.terminate()
+            pool.shutdown(wait=not timed_out, cancel_futures=True)
+
+
+def author_feed_chunks(
+    client: Client, actors: List[str], limit: int, step: int
+) -> Iterator[Tuple[List[str], List[Tuple[List[Candidate], Dict[str, int]]]]]:
+    """(chunk, author candidates) per block of step actors, in threads or in shard processes."""
+    if LIST_WORKER_PROCESSES > 1 and len(actors) > step:
+        yield from sharded_author_feeds(client, actors, limit, LIST_WORKER_PROCESSES, step)
+        return
+    for start in range(0, len(actors), step):
+        chunk = actors[start:start + step]
+        yield chunk, fetch_author_feeds(client, chunk, limit, AUTHOR_FEED_WORKERS)
 
 
-def fetch_hashtag_posts(client: Client, query: str, max_items: int) -> List:
-    try:
-        out = client.app.bsky.feed.search_posts({"q": query, "sort": "latest", "limit": max_items})
-        return getattr(out, "posts", []) or []
-    except Exception:
-        return []
+def fetch_posts_counts(client: Client, actors: List[str], workers: int) -> Dict[str, int]:
+    """postsCount per actor via batched getProfiles. Actors that fail to resolve are absent."""
+    batches = [actors[i:i + PROFILES_BATCH_SIZE] for i in range(0, len(actors), PROFILES_BATCH_SIZE)]
+
+    def one(batch: List[str]) -> Dict[str, int]:
+        try:
+            out = client.app.bsky.actor.get_profiles({"actors": batch})
+        except Exception as e:
+            log(f"⚠️ get_profiles failed: {e}")
+            return {}
+        counts: Dict[str, int] = {}
+        for p in getattr(out, "profiles", []) or []:
+            n = getattr(p, "posts_count", None)
+            if n is None:
+                n = getattr(p, "postsCount", None)
+            if n is None:
+                continue
+            for k in (getattr(p, "did", ""), getattr(p, "handle", "")):
+                if k:
+                    counts[k.lower()] = int(n)
+        return counts
+
+    counts: Dict[str, int] = {}
+    if workers <= 1 or len(batches) <= 1:
+        results = [one(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+            results = list(pool.map(one, batches))
+    for r in results:
+        counts.update(r)
+    return counts
 
 
-def build_candidates_from_feed_items(
+def changed_authors(
+    client: Client, actors: List[str], watermarks: Dict[str, int], workers: int
+) -> Tuple[List[str], Dict[str, int]]:
+    """Actors whose postsCount differs from the stored watermark (or is unknown)."""
+    counts = fetch_posts_counts(client, actors, workers)
+    changed = [a for a in actors if a not in counts or watermarks.get(a) != counts[a]]
+    return changed, counts
+
+
+def fetch_hashtag_pages(client: Client, query: str, max_items: int, since: Optional[datetime] = None) -> Iterator[List]:
+    """Search newest-first with cursor paging, one page at a time, only posts from since onwards."""
+    fetched = 0
+    cursor = None
+    while True:
+        params = {"q": query, "sort": "latest", "limit": min(100, max_items)}
+        if since is not None:
+            params["since"] = since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        if cursor:
+            params["cursor"] = cursor
+        try:
+            out = client.app.bsky.feed.search_posts(params)
+        except Exception as e:
+            log(f"⚠️ search_posts failed for {query}: {e}")
+            break
+        batch = (getattr(out, "posts", []) or [])[:max_items - fetched]
+        cursor = getattr(out, "cursor", None)
+        fetched += len(batch)
+        yield batch
+        if not cursor or not batch or fetched >= max_items:
+            break
+        if since is not None:
+            times = [t for t in (parse_time(p) for p in batch) if t]
+            if times and min(times) < since:
+                break
+
+
+def feed_item_candidates(
     items: List,
-    cutoff: datetime,
+    cutoff: Optional[datetime],
     exclude_handles: Set[str],
     exclude_dids: Set[str],
     force_refresh: bool,
-) -> List[Dict]:
-    cands: List[Dict] = []
+    funnel: Dict[str, int],
+) -> List[Candidate]:
+    """Candidates for one page of feed items, unsorted; drop reasons are counted in funnel."""
+    cands: List[Candidate] = []
+    funnel["fetched"] = funnel.get("fetched", 0) + len(items)
     for item in items:
         post = getattr(item, "post", None)
         if not post:
+            funnel["invalid"] = funnel.get("invalid", 0) + 1
             continue
 
         if hasattr(item, "reason") and item.reason is not None:
+            funnel["repost_reason"] = funnel.get("repost_reason", 0) + 1
             continue
 
-        record = getattr(post, "record", None)
-        if not record:
-            continue
-
-        if getattr(record, "reply", None):
-            continue
-
-        if is_quote_post(record):
-            continue
-
-        if not has_media(record):
-            continue
-
-        uri = getattr(post, "uri", None)
-        cid = getattr(post, "cid", None)
-        if not uri or not cid:
-            continue
-
-        author = getattr(post, "author", None)
-        ah = (getattr(author, "handle", "") or "").lower()
-        ad = (getattr(author, "did", "") or "").lower()
-
-        if ah in exclude_handles or ad in exclude_dids:
-            continue
-
-        created = parse_time(post)
-        if not created:
-            continue
-
-        if created < cutoff and not force_refresh:
-            continue
+        cand = postview_candidate(post, cutoff, exclude_handles, exclude_dids, force_refresh, funnel)
+        if cand:
+            cands.append(cand)
+    return cands
 
-        cands.append(
-            {
-                "uri": uri,
-                "cid": cid,
-                "created": created,
-                "author_key": ad or ah or uri,
-                "force_refresh": force_refresh,
-            }
-        )
 
-    cands.sort(key=lambda x: x["created"])
-    return cands
+def latest_per_author(cands: List[Candidate]) -> List[Candidate]:
+    latest: Dict[str, Candidate] = {}
+    for c in cands:
+        prev = latest.get(c.author_key)
+        if prev is None or c.ts >= prev.ts:
+            latest[c.author_key] = c
+    return sorted(latest.values(), key=lambda x: x.ts)
 
 
-def build_candidates_from_postviews(
-    posts: List,
-    cutoff: datetime,
+def postview_candidate(
+    post,
+    cutoff: Optional[datetime],
     exclude_handles: Set[str],
     exclude_dids: Set[str],
-) -> List[Dict]:
-    cands: List[Dict] = []
-    for post in posts:
-        record = getattr(post, "record", None)
-        if not record:
-            continue
-
-        if getattr(record, "reply", None):
-            continue
-
-        if is_quote_post(record):
-            continue
+    force_refresh: bool,
+    funnel: Dict[str, int],
+) -> Optional[Candidate]:
+    """Candidate for one post view, or None; the reason for dropping it is counted in funnel."""
+    def drop(reason: str) -> None:
+        funnel[reason] = funnel.get(reason, 0) + 1
 
-        if not has_media(record):
-            continue
+    record = getattr(post, "record", None)
+    if not record:
+        return drop("invalid")
+
+    if getattr(record, "reply", None):
+        return drop("reply")
+
+    if is_quote_post(record):
+        return drop("quote")
+
+    if not has_media(record):
+        return drop("no_media")
+
+    uri = getattr(post, "uri", None)
+    cid = getattr(post, "cid", None)
+    if not uri or not cid:
+        return drop("invalid")
+
+    author = getattr(post, "author", None)
+    ah = (getattr(author, "handle", "") or "").lower()
+    ad = (getattr(author, "did", "") or "").lower()
+
+    if ah in exclude_handles or ad in exclude_dids:
+        return drop("excluded")
+
+    created = parse_time(post)
+    if not created:
+        return drop("invalid")
+
+    if cutoff is not None and created < cutoff and not force_refresh:
+        return drop("too_old")
+
+    funnel["candidates"] = funnel.get("candidates", 0) + 1
+    return Candidate(uri, cid, created.timestamp(), ad or ah or uri, force_refresh)
+
+
+def due_authors(actors: List[str], schedule: Dict[str, List[float]], now_ts: float, budget: int) -> List[str]:
+    """Actors whose next poll time has passed, most overdue first (never polled first), at most budget."""
+    due = [a for a in actors if a not in schedule or schedule[a][0] <= now_ts]
+    due.sort(key=lambda a: schedule[a][0] if a in schedule else 0)
+    if len(due) > budget:
+        STATS.count("poll_deferred", len(due) - budget)
+        # langer dan de slack over tijd: hun posts kunnen buiten HOURS_BACK vallen
+        late = sum(1 for a in due[budget:] if a in schedule and now_ts - schedule[a][0] > AUTHOR_POLL_SLACK_MINUTES * 60)
+        if late:
+            STATS.count("poll_overdue", late)
+            log(f"⚠️ {late} deferred members are past their max poll gap, posts may be missed; raise AUTHOR_POLL_BUDGET")
+    return due[:budget]
+
+
+def schedule_author(schedule: Dict[str, List[float]], actor: str, now_ts: float, last_post: Optional[float]) -> None:
+    """Next poll after now: quiet authors later, but never later than AUTHOR_MAX_POLL_GAP_HOURS."""
+    prev = schedule.get(actor)
+    if last_post is None and prev:
+        last_post = prev[1] or None
+    gap = AUTHOR_MAX_POLL_GAP_HOURS * 3600
+    idle = now_ts - last_post if last_post else gap
+    interval = min(gap, max(0.0, idle) * AUTHOR_POLL_BACKOFF)
+    schedule[actor] = [round(now_ts + interval), round(last_post or 0)]
+
+
+def wait_excludes(ctx: Dict) -> Tuple[Set[str], Set[str]]:
+    """Exclude handles/DIDs; blocks until the background exclude load is done."""
+    handles, dids, _ = ctx["excludes"].result()
+    return handles, dids
+
+
+def settle_time_watermark(
+    watermarks: Dict[str, str],
+    key: str,
+    cands: List[Candidate],
+    newest: Optional[datetime],
+    posted: MutableMapping[str, str],
+) -> None:
+    """After the writes: watermark just before the oldest candidate that was not posted, else newest.
+
+    The next run then fetches back to that candidate, so nothing in the window is skipped.
+    """
+    unposted = [c.ts for c in cands if c.uri not in posted]
+    if unposted:
+        newest = datetime.fromtimestamp(min(unposted) - 1, tz=timezone.utc)
+    if newest:
+        watermarks[key] = newest.isoformat()
+
+
+def feed_source(ctx: Dict, key: str, note: str, furi: str, is_promo: bool, chronological: bool) -> Iterator[Candidate]:
+    client = ctx["client"]
+    cutoff = ctx["cutoff"]
+    feed_watermarks: Dict[str, str] = ctx["state"]["feed_watermarks"]
+    log(f"📥 Feed: {key} ({note})" + (" [PROMO]" if is_promo else ""))
+
+    # promo negeert de cutoff, dus daar altijd volledig pagineren
+    stop_before: Optional[datetime] = None
+    if not is_promo:
+        stop_before = cutoff
+        hwm = feed_watermarks.get(furi)
+        if hwm:
+            try:
+                stop_before = max(cutoff, datetime.fromisoformat(hwm))
+            except ValueError:
+                pass
 
-        uri = getattr(post, "uri", None)
-        cid = getattr(post, "cid", None)
-        if not uri or not cid:
-            continue
+    # per pagina filteren, de post views van een pagina zijn daarna weg
+    cands: List[Candidate] = []
+    funnel: Dict[str, int] = {}
+    newest: Optional[datetime] = None
+    try:
+        for page in fetch_feed_pages(
+            client, furi, max_items=FEED_MAX_ITEMS, stop_before=stop_before, chronological=chronological
+        ):
+            page_newest = newest_item_time(page)
+            if page_newest and (newest is None or page_newest > newest):
+                newest = page_newest
+            exclude_handles, exclude_dids = wait_excludes(ctx)
+            cands.extend(feed_item_candidates(page, cutoff, exclude_handles, exclude_dids, is_promo, funnel))
+    except Exception as e:
+        log(f"⚠️ get_feed failed for {furi}: {e} (skip this feed)")
+        invalidate_resolution(ctx["state"]["resolve_cache"], furi)
+        return
+    STATS.add_funnel(funnel)
+    log(f"📰 Feed items fetched: {funnel.get('fetched', 0)}")
+    if not is_promo:
+        # niet gebruikte kandidaten (vroege stop, budget) tellen als niet gepost
+        ctx["on_posted"].append(partial(settle_time_watermark, feed_watermarks, furi, cands, newest))
+    cands.sort(key=lambda x: x.ts)
+    yield from cands
+
+
+def list_source(ctx: Dict, key: str, note: str, luri: str, is_promo: bool) -> Iterator[Candidate]:
+    client = ctx["client"]
+    cutoff = ctx["cutoff"]
+    author_watermarks: Dict[str, int] = ctx["state"]["author_watermarks"]
+    log(f"📋 List: {key} ({note})" + (" [PROMO]" if is_promo else ""))
+
+    if LIST_MODE == "listfeed":
+        cands: List[Candidate] = []
+        funnel: Dict[str, int] = {}
+        # promo negeert de cutoff (laatste post per lid), dus dan niet vroeg stoppen
+        for page in fetch_list_feed_pages(client, luri, None if is_promo else cutoff, max_items=LIST_FEED_MAX_ITEMS):
+            exclude_handles, exclude_dids = wait_excludes(ctx)
+            cands.extend(feed_item_candidates(page, cutoff, exclude_handles, exclude_dids, is_promo, funnel))
+        STATS.add_funnel(funnel)
+        log(f"📰 List feed items fetched: {funnel.get('fetched', 0)}")
+        cands.sort(key=lambda x: x.ts)
+        yield from (latest_per_author(cands) if is_promo else cands)
+        return
 
-        author = getattr(post, "author", None)
-        ah = (getattr(author, "handle", "") or "").lower()
-        ad = (getattr(author, "did", "") or "").lower()
+    members = fetch_list_members(client, luri, limit=max(1000, LIST_MEMBER_LIMIT))
+    log(f"👥 Members fetched: {len(members)}")
+    if not members:
+        invalidate_resolution(ctx["state"]["resolve_cache"], luri)
+
+    # uitgesloten leden vallen al voor het ophalen af, hun feeds worden niet opgehaald
+    exclude_handles, exclude_dids = wait_excludes(ctx)
+    actors = [d or h for (h, d) in members if (d or h) and h not in exclude_handles and d not in exclude_dids]
+    if len(actors) < len(members):
+        STATS.add_funnel({"excluded": len(members) - len(actors)})
+
+    # promo pakt altijd de laatste post per lid, daar hebben planning en pre-check geen zin
+    schedule: Optional[Dict[str, List[float]]] = None
+    now_ts = time.time()
+    if AUTHOR_POLL_BUDGET > 0 and not is_promo:
+        schedule = ctx["state"]["author_schedule"]
+        total = len(actors)
+        actors = due_authors(actors, schedule, now_ts, ctx["poll_budget"])
+        ctx["poll_budget"] -= len(actors)
+        log(f"🗓️ Members due this run: {len(actors)} of {total}")
+
+    counts: Dict[str, int] = {}
+    if AUTHOR_PRECHECK and not is_promo and actors:
+        checked = actors
+        actors, counts = changed_authors(client, actors, author_watermarks, AUTHOR_FEED_WORKERS)
+        log(f"🔍 Members with new activity: {len(actors)}")
+        if schedule is not None:
+            # ongewijzigd postsCount = niets nieuws, alleen opnieuw inplannen
+            changed = set(actors)
+            for actor in checked:
+                if actor not in changed:
+                    schedule_author(schedule, actor, now_ts, None)
+
+    # in blokken ophalen, zodat de pipeline halverwege een lijst kan stoppen
+    step = AUTHOR_FEED_WORKERS * 4
+    chunks = author_feed_chunks(client, actors, AUTHOR_POSTS_PER_MEMBER, step)
+    done = 0
+    try:
+        while not DEADLINE.near():
+            pulled = next(chunks, None)
+            if pulled is None:
+                if done < len(actors):
+                    STATS.skip_source(f"list:{key}", done > 0)
+                return
+            chunk, results = pulled
+            done += len(chunk)
+            yield from list_chunk_candidates(ctx, chunk, results, is_promo, counts, schedule, now_ts)
+        log(f"⏰ Run deadline near, skip rest of list {key} ({len(actors) - done} members)")
+        STATS.skip_source(f"list:{key}", done > 0)
+    finally:
+        chunks.close()
+
+
+def settle_author_watermark(
+    watermarks: Dict[str, int], actor: str, count: int, fresh: List[Candidate], posted: MutableMapping[str, str]
+) -> None:
+    """Store postsCount once every in-window candidate of actor is in the repost records."""
+    if all(c.uri in posted for c in fresh):
+        watermarks[actor] = count
+
+
+def list_chunk_candidates(
+    ctx: Dict,
+    chunk: List[str],
+    results: List[Tuple[List[Candidate], Dict[str, int]]],
+    is_promo: bool,
+    counts: Dict[str, int],
+    schedule: Optional[Dict[str, List[float]]],
+    now_ts: float,
+) -> Iterator[Candidate]:
+    """Candidates of one fetched chunk of list members.
+
+    A member's postsCount watermark is only stored after the writes, and only when all
+    of their in-window candidates got posted; otherwise the pre-check fetches them again.
+    """
+    author_watermarks: Dict[str, int] = ctx["state"]["author_watermarks"]
+    cutoff_ts = ctx["cutoff"].timestamp()
+    for actor, (cands, funnel) in zip(chunk, results):
+        STATS.add_funnel(funnel)
+        # mislukte fetch: geen watermark/planning, dus volgende run opnieuw
+        failed = "fetch_failed" in funnel
+        if is_promo:
+            if cands:
+                yield cands[-1]._replace(promo=True)
+        else:
+            fresh = [c for c in cands if c.ts >= cutoff_ts]
+            if len(fresh) < len(cands):
+                # de gecachte kandidaten zijn zonder cutoff gebouwd
+                old = len(cands) - len(fresh)
+                STATS.add_funnel({"too_old": old, "candidates": -old})
+            yield from fresh
+            # pas na het afnemen van de kandidaten, anders gaan posts verloren bij een vroege stop
+            if actor in counts and not failed:
+                ctx["on_posted"].append(partial(settle_author_watermark, author_watermarks, actor, counts[actor], fresh))
+        if schedule is not None and not failed:
+            schedule_author(schedule, actor, now_ts, cands[-1].ts if cands else None)
+
+
+def hashtag_source(ctx: Dict, query: str) -> Iterator[Candidate]:
+    cutoff = ctx["cutoff"]
+    hashtag_watermarks: Dict[str, str] = ctx["state"]["hashtag_watermarks"]
+    log(f"🔎 Hashtag search: {query}")
+    since = cutoff
+    hwm = hashtag_watermarks.get(query)
+    if hwm:
+        try:
+            since = max(cutoff, datetime.fromisoformat(hwm))
+        except ValueError:
+            pass
 
-        if ah in exclude_handles or ad in exclude_dids:
-            continue
+    cands: List[Candidate] = []
+    funnel: Dict[str, int] = {}
+    newest: Optional[datetime] = None
+    for page in fetch_hashtag_pages(ctx["client"], query, HASHTAG_MAX_ITEMS, since=since):
+        times = [t for t in (parse_time(p) for p in page) if t]
+        if times and (newest is None or max(times) > newest):
+            newest = max(times)
+        exclude_handles, exclude_dids = wait_excludes(ctx)
+        funnel["fetched"] = funnel.get("fetched", 0) + len(page)
+        for post in page:
+            cand = postview_candidate(post, cutoff, exclude_handles, exclude_dids, False, funnel)
+            if cand:
+                cands.append(cand)
+    STATS.add_funnel(funnel)
+    log(f"Hashtag posts fetched for {query}: {funnel.get('fetched', 0)}")
+    # de since van de volgende run: niet voorbij de oudste kandidaat die niet gepost is
+    ctx["on_posted"].append(partial(settle_time_watermark, hashtag_watermarks, query, cands, newest))
+    cands.sort(key=lambda x: x.ts)
+    yield from cands
+
+
+def refreshed_since(record_uri: Optional[str], since: datetime) -> bool:
+    """True when the repost record was created after since (record keys are TIDs)."""
+    parsed = parse_at_uri_rkey(record_uri) if record_uri else None
+    created = tid_time(parsed[2]) if parsed else None
+    return bool(created and created >= since)
+
+
+def collect_candidates(
+    sources: Iterable[Iterator[Candidate]],
+    repost_records: MutableMapping[str, str],
+    early_stop: bool,
+    promo_seen: Optional[Dict[str, str]] = None,
+) -> Tuple[List[Candidate], List[Candidate]]:
+    """Pull candidates source by source, dedup inline, stop once the run budget is filled.
+
+    Sources are generators, so sources after the stop point are never fetched.
+    Promo posts whose current repost is younger than PROMO_REFRESH_MINUTES (minus
+    PROMO_REFRESH_TOLERANCE_MINUTES) are skipped, leaving their share of MAX_PER_RUN
+    to normal candidates.
+    """
+    seen: Set[str] = set()
+    per_user_count: Dict[str, int] = {}
+    normal: List[Candidate] = []
+    promo: List[Candidate] = []
+    now = utcnow()
+    fresh_after = now - timedelta(minutes=max(0.0, PROMO_REFRESH_MINUTES - PROMO_REFRESH_TOLERANCE_MINUTES))
+
+    for source in sources:
+        for c in source:
+            uri = c.uri
+            if not uri or uri in seen:
+                STATS.count("duplicate")
+                continue
+            seen.add(uri)
+
+            if c.promo:
+                if promo_seen is not None:
+                    promo_seen[uri] = now.isoformat()
+                if PROMO_REFRESH_MINUTES > 0 and refreshed_since(repost_records.get(uri), fresh_after):
+                    STATS.count("promo_recently_refreshed")
+                    continue
+                STATS.count("accepted_promo")
+                promo.append(c)
+                continue
 
-        created = parse_time(post)
-        if not created or created < cutoff:
-            continue
+            if uri in repost_records:
+                STATS.count("already_reposted")
+                continue
+            ak = c.author_key
+            if per_user_count.get(ak, 0) >= MAX_PER_USER:
+                STATS.count("per_user_cap")
+                continue
+            per_user_count[ak] = per_user_count.get(ak, 0) + 1
+            STATS.count("accepted")
+            normal.append(c)
 
-        cands.append(
-            {
-                "uri": uri,
-                "cid": cid,
-                "created": created,
-                "author_key": ad or ah or uri,
-                "force_refresh": False,
-            }
-        )
+            if early_stop and len(normal) >= max(0, MAX_PER_RUN - len(promo)):
+                log(f"⏹️ Run budget filled ({len(normal)} normal + {len(promo)} promo), skip remaining sources")
+                return normal, promo
 
-    cands.sort(key=lambda x: x["created"])
-    return cands
+    return normal, promo
 
 
 def force_unrepost_unlike_if_needed(
     client: Client,
     me: str,
     subject_uri: str,
-    repost_records: Dict[str, str],
-    like_records: Dict[str, str],
+    repost_records: MutableMapping[str, str],
+    like_records: MutableMapping[str, str],
 ):
     if subject_uri in repost_records:
         existing_repost_uri = repost_records.get(subject_uri)
@@ -451,8 +1820,8 @@ def repost_and_like(
     me: str,
     subject_uri: str,
     subject_cid: str,
-    repost_records: Dict[str, str],
-    like_records: Dict[str, str],
+    repost_records: MutableMapping[str, str],
+    like_records: MutableMapping[str, str],
     force_refresh: bool,
 ) -> bool:
     if force_refresh:
@@ -493,188 +1862,959 @@ def repost_and_like(
     return True
 
 
+def own_record_rkey(uri: Optional[str], me: str, collection: str) -> Optional[str]:
+    parsed = parse_at_uri_rkey(uri) if uri else None
+    if not parsed:
+        return None
+    did, coll, rkey = parsed
+    if did != me or coll != collection:
+        return None
+    return rkey
+
+
+def select_candidates(
+    normal_cands: List[Candidate],
+    promo_cands: List[Candidate],
+    repost_records: MutableMapping[str, str],
+    per_user_count: Optional[Dict[str, int]] = None,
+    budget: Optional[int] = None,
+) -> List[Candidate]:
+    """Apply the run budget and MAX_PER_USER up front, same rules as the single-write loop.
+
+    per_user_count and budget carry what is already used when a window spans several calls.
+    """
+    selected: List[Candidate] = []
+    if per_user_count is None:
+        per_user_count = {}
+    if budget is None:
+        budget = MAX_PER_RUN
+    normal_budget = max(0, budget - len(promo_cands))
+
+    for c in normal_cands:
+        if len(selected) >= normal_budget:
+            break
+        if c.uri in repost_records:
+            continue
+        ak = c.author_key
+        if per_user_count.get(ak, 0) >= MAX_PER_USER:
+            continue
+        per_user_count[ak] = per_user_count.get(ak, 0) + 1
+        selected.append(c)
+
+    for c in promo_cands:
+        if len(selected) >= budget:
+            break
+        selected.append(c)
+
+    return selected
+
+
+def candidate_writes(me: str, c: Candidate, repost_records: MutableMapping[str, str], like_records: MutableMapping[str, str]) -> List[Dict]:
+    """applyWrites operations for one candidate: promo deletes first, then repost + like."""
+    writes: List[Dict] = []
+    subject_uri = c.uri
+    if c.promo:
+        rkey = own_record_rkey(repost_records.get(subject_uri), me, "app.bsky.feed.repost")
+        if rkey:
+            writes.append(
+                {"$type": "com.atproto.repo.applyWrites#delete", "collection": "app.bsky.feed.repost", "rkey": rkey}
+            )
+        rkey = own_record_rkey(like_records.get(subject_uri), me, "app.bsky.feed.like")
+        if rkey:
+            writes.append(
+                {"$type": "com.atproto.repo.applyWrites#delete", "collection": "app.bsky.feed.like", "rkey": rkey}
+            )
+
+    now = utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    for collection in ("app.bsky.feed.repost", "app.bsky.feed.like"):
+        writes.append(
+            {
+                "$type": "com.atproto.repo.applyWrites#create",
+                "collection": collection,
+                "rkey": next_tid(),
+                "value": {
+                    "$type": collection,
+                    "subject": {"uri": subject_uri, "cid": c.cid},
+                    "createdAt": now,
+                },
+            }
+        )
+    return writes
+
+
+def batch_committed(client: Client, me: str, writes: List[Dict]) -> Optional[bool]:
+    """Whether an applyWrites batch with unknown outcome was committed; None when that can't be checked.
+
+    applyWrites is one repo commit, so the first preset create rkey answers for the whole batch.
+    """
+    create = next((w for w in writes if w["$type"].endswith("#create")), None)
+    if create is None:
+        return None
+    try:
+        client.com.atproto.repo.get_record({"repo": me, "collection": create["collection"], "rkey": create["rkey"]})
+        return True
+    except Exception as e:
+        resp = getattr(e, "response", None)
+        if getattr(resp, "status_code", None) == 400 and getattr(getattr(resp, "content", None), "error", None) == "RecordNotFound":
+            return False
+        log(f"⚠️ Could not check applyWrites outcome: {e}")
+        return None
+
+
+def apply_writes_batched(
+    client: Client,
+    me: str,
+    selected: List[Candidate],
+    repost_records: MutableMapping[str, str],
+    like_records: MutableMapping[str, str],
+) -> int:
+    """Post selected candidates in applyWrites batches.
+
+    Only a batch the PDS rejected (4xx) falls back to single writes. After a timeout or 5xx
+    the preset rkeys are looked up first; a committed batch counts as posted. An uncommitted
+    batch after a 5xx falls back too; after a timeout it may still be in flight, so it is left
+    for the next run. When even the check fails the batch is kept as posted: a missed repost
+    beats a duplicate, and RECONCILE drops records that are not in the repo.
+    """
+    done = 0
+    i = 0
+    while i < len(selected):
+        if DEADLINE.expired():
+            log(f"⏰ Run deadline reached, {len(selected) - i} selected posts not posted")
+            break
+        chunk: List[Candidate] = []
+        writes: List[Dict] = []
+        while i < len(selected):
+            w = candidate_writes(me, selected[i], repost_records, like_records)
+            if chunk and len(writes) + len(w) > WRITE_BATCH_SIZE:
+                break
+            chunk.append(selected[i])
+            writes.extend(w)
+            i += 1
+
+        try:
+            client.com.atproto.repo.apply_writes({"repo": me, "writes": writes})
+        except DeadlineExceeded as e:
+            # niet verstuurd: de limiter wachtte niet meer
+            log(f"⏰ {e}, {len(selected) - i + len(chunk)} selected posts not posted")
+            break
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            rejected = status is not None and 400 <= status < 500
+            committed = False if rejected else batch_committed(client, me, writes)
+            if committed is None:
+                log(f"⚠️ applyWrites outcome unknown ({len(writes)} ops): {e} — kept as posted, not resent")
+            elif not committed and status is None:
+                log(f"⚠️ applyWrites failed ({len(writes)} ops): {e} — not committed yet, left for the next run")
+                continue
+            elif not committed:
+                log(f"⚠️ applyWrites failed ({len(writes)} ops): {e} — fallback to single writes")
+                for c in chunk:
+                    if DEADLINE.expired():
+                        break
+                    promo = c.promo
+                    if repost_and_like(client, me, c.uri, c.cid, repost_records, like_records, force_refresh=promo):
+                        done += 1
+                        log(f"✅ {'PROMO refresh repost+like' if promo else 'Repost+Like'}: {c.uri}")
+                continue
+            else:
+                log(f"⚠️ applyWrites reported {e}, but the batch was committed")
+
+        # rkeys zijn vooraf gekozen, dus de record URIs zijn bekend zonder de results te lezen
+        for c in chunk:
+            repost_records.pop(c.uri, None)
+            like_records.pop(c.uri, None)
+        for w in writes:
+            if not w["$type"].endswith("#create"):
+                continue
+            uri = f"at://{me}/{w['collection']}/{w['rkey']}"
+            subject_uri = w["value"]["subject"]["uri"]
+            if w["collection"] == "app.bsky.feed.repost":
+                repost_records[subject_uri] = uri
+            else:
+                like_records[subject_uri] = uri
+
+        for c in chunk:
+            done += 1
+            log(f"✅ {'PROMO refresh repost+like' if c.promo else 'Repost+Like'}: {c.uri}")
+        log(f"📦 applyWrites batch: {len(chunk)} posts, {len(writes)} ops")
+
+    return done
+
+
+def fetch_exclude_entry(client: Client, luri: str, resolve_cache: Dict[str, Dict]) -> Optional[Dict]:
+    """Cache entry for an exclude list, None when the list could not be read completely."""
+    members = fetch_list_members(client, luri, limit=max(1000, LIST_MEMBER_LIMIT), partial_ok=False)
+    if not members:
+        invalidate_resolution(resolve_cache, luri)
+    if members is None:
+        return None
+    return {
+        "handles": sorted({h.lower() for h, _ in members if h}),
+        "dids": sorted({d.lower() for _, d in members if d}),
+        "at": utcnow().isoformat(),
+    }
+
+
+def load_exclude_sets(
+    client: Client,
+    excl_uris: List[Tuple[str, str, str]],
+    cache: Dict[str, Dict],
+    resolve_cache: Dict[str, Dict],
+) -> Tuple[Set[str], Set[str], Optional[threading.Thread]]:
+    """Exclude handles/DIDs from cache where possible.
+
+    Lists without a cache entry are loaded now. Stale entries are used as-is and refreshed
+    in a background thread; join it before saving state. A failed load is never cached:
+    a failed refresh keeps the old entry (still stale), a failed first load excludes nobody
+    from that list for this run only.
+    """
+    exclude_handles: Set[str] = set()
+    exclude_dids: Set[str] = set()
+    stale: List[str] = []
+
+    for key, note, luri in excl_uris:
+        entry = cache.get(luri)
+        fresh = False
+        if entry:
+            try:
+                age = utcnow() - datetime.fromisoformat(entry["at"])
+                fresh = age < timedelta(hours=EXCLUDE_REFRESH_HOURS)
+            except (KeyError, TypeError, ValueError):
+                entry = None
+        if entry is None:
+            log(f"🚫 Loading exclude list: {key} ({note})")
+            entry = fetch_exclude_entry(client, luri, resolve_cache)
+            if entry is None:
+                log(f"⚠️ Exclude list {key} not loaded, retry next run")
+                entry = {}
+            else:
+                cache[luri] = entry
+        elif not fresh:
+            stale.append(luri)
+        log(f"🚫 Exclude members ({key}): {len(entry.get('dids', []))}" + (" [cached]" if fresh else " [stale, refreshing]" if luri in stale else ""))
+        exclude_handles.update(entry.get("handles", []))
+        exclude_dids.update(entry.get("dids", []))
+
+    # alleen lijsten die in deze run gebruikt worden bewaren
+    active = {luri for _, _, luri in excl_uris}
+    for luri in [k for k in cache if k not in active]:
+        cache.pop(luri, None)
+
+    if not stale:
+        return exclude_handles, exclude_dids, None
+
+    def refresh():
+        refreshed = 0
+        for luri in stale:
+            entry = fetch_exclude_entry(client, luri, resolve_cache)
+            # mislukt: oude entry met oude tijd houden, volgende run opnieuw proberen
+            if entry is not None:
+                cache[luri] = entry
+                refreshed += 1
+        log(f"🚫 Exclude cache refreshed: {refreshed} of {len(stale)} list(s)")
+
+    t = threading.Thread(target=refresh, name="exclude-refresh", daemon=True)
+    t.start()
+    return exclude_handles, exclude_dids, t
+
+
+def save_session(path: str, session_string: str) -> None:
+    tmp = path + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(session_string)
+    os.replace(tmp, path)
+
+
+def list_own_records(client: Client, me: str, collection: str, since: datetime) -> Optional[Dict[str, str]]:
+    """subject URI -> record URI of own records in collection created since; None if listing failed.
+
+    listRecords returns newest first, so paging stops at the first record before since.
+    """
+    index: Dict[str, str] = {}
+    cursor = None
+    while True:
+        params = {"repo": me, "collection": collection, "limit": 100}
+        if cursor:
+            params["cursor"] = cursor
+        try:
+            out = client.com.atproto.repo.list_records(params)
+        except Exception as e:
+            log(f"⚠️ listRecords failed for {collection}: {e}")
+            return None
+        records = getattr(out, "records", []) or []
+        for rec in records:
+            uri = getattr(rec, "uri", None)
+            parsed = parse_at_uri_rkey(uri) if uri else None
+            created = tid_time(parsed[2]) if parsed else None
+            if created and created < since:
+                return index
+            value = getattr(rec, "value", None)
+            subject = value.get("subject") if isinstance(value, dict) else getattr(value, "subject", None)
+            subject_uri = subject.get("uri") if isinstance(subject, dict) else getattr(subject, "uri", None)
+            if uri and subject_uri:
+                index.setdefault(subject_uri, uri)
+        cursor = getattr(out, "cursor", None)
+        if not cursor or not records:
+            break
+    return index
+
+
+def reconcile_records(client: Client, me: str, state: Dict, since: datetime) -> int:
+    """Bring repost/like records in line with the account's own repo back to since; returns changes."""
+    collections = {"repost_records": "app.bsky.feed.repost", "like_records": "app.bsky.feed.like"}
+    with ThreadPoolExecutor(max_workers=len(collections)) as pool:
+        listed = list(pool.map(lambda c: list_own_records(client, me, c, since), collections.values()))
+
+    changed = 0
+    for key, index in zip(collections, listed):
+        if index is None:
+            continue
+        records: MutableMapping[str, str] = state[key]
+        known = set(index.values())
+        # eigen records binnen de horizon die niet (meer) in de repo staan
+        recent = records.created_since(since) if isinstance(records, SqliteRecords) else list(records.items())
+        for subject_uri, record_uri in recent:
+            parsed = parse_at_uri_rkey(record_uri)
+            created = tid_time(parsed[2]) if parsed else None
+            if parsed and parsed[0] == me and created and created >= since and record_uri not in known:
+                records.pop(subject_uri, None)
+                changed += 1
+        for subject_uri, record_uri in index.items():
+            if records.get(subject_uri) != record_uri:
+                records[subject_uri] = record_uri
+                changed += 1
+    return changed
+
+
+def maybe_reconcile(client: Client, me: str, state: Dict) -> None:
+    if RECONCILE in ("0", "false", "no", "off"):
+        return
+    if RECONCILE == "auto" and (len(state["repost_records"]) or len(state["like_records"])):
+        return
+    changed = reconcile_records(client, me, state, utcnow() - timedelta(hours=RECONCILE_HOURS))
+    log(f"🔁 Reconciled repost/like records from own repo: {changed} changes")
+
+
+def login_client(client: Client, username: str, password: str, session_path: str) -> None:
+    """Resume the saved session (refreshing tokens when needed), else log in with the password."""
+    if session_path:
+        def on_session_change(event, session) -> None:
+            try:
+                save_session(session_path, client.export_session_string())
+            except Exception as e:
+                log(f"⚠️ Could not save session: {e}")
+
+        client.on_session_change(on_session_change)
+
+    if session_path and os.path.exists(session_path):
+        try:
+            with open(session_path, "r", encoding="utf-8") as f:
+                session_string = f.read().strip()
+            client.login(session_string=session_string)
+            log("🔑 Resumed saved session")
+            return
+        except Exception as e:
+            log(f"⚠️ Session resume failed: {e} — password login")
+
+    client.login(username, password)
+    if session_path:
+        try:
+            save_session(session_path, client.export_session_string())
+        except Exception as e:
+            log(f"⚠️ Could not save session: {e}")
+
+
+def resolve_sources(client: Client, resolve_cache: Dict[str, Dict]):
+    """(feed_uris, feed_chronological, list_uris, excl_uris) for the configured FEEDS/LIJSTEN/EXCLUDE_LISTS.
+
+    All links are resolved concurrently; the result keeps the config order.
+    """
+    feed_chronological: Dict[str, bool] = {
+        key: bool(obj.get("chronological", FEED_CHRONOLOGICAL)) for key, obj in FEEDS.items()
+    }
+    jobs: List[Tuple[str, str, str, str, object]] = []
+    for kind, config, normalize in (
+        ("feed", FEEDS, normalize_feed_uri),
+        ("list", LIJSTEN, normalize_list_uri),
+        ("exclude", EXCLUDE_LISTS, normalize_list_uri),
+    ):
+        for key, obj in config.items():
+            link = (obj.get("link") or "").strip()
+            note = (obj.get("note") or "").strip()
+            if link:
+                jobs.append((kind, key, note, link, normalize))
+
+    if AUTHOR_FEED_WORKERS > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=min(AUTHOR_FEED_WORKERS, len(jobs))) as pool:
+            uris = list(pool.map(lambda j: cached_normalize(client, j[3], j[4], resolve_cache), jobs))
+    else:
+        uris = [cached_normalize(client, j[3], j[4], resolve_cache) for j in jobs]
+
+    out: Dict[str, List[Tuple[str, str, str]]] = {"feed": [], "list": [], "exclude": []}
+    labels = {"feed": "Feed", "list": "Lijst", "exclude": "Exclude lijst"}
+    for (kind, key, note, link, _), uri in zip(jobs, uris):
+        if uri:
+            out[kind].append((key, note, uri))
+        else:
+            log(f"⚠️ {labels[kind]} ongeldig (skip): {key} -> {link}")
+
+    return out["feed"], feed_chronological, out["list"], out["exclude"]
+
+
+def post_candidates(
+    client: Client,
+    me: str,
+    normal_cands: List[Candidate],
+    promo_cands: List[Candidate],
+    repost_records: MutableMapping[str, str],
+    like_records: MutableMapping[str, str],
+    per_user_count: Optional[Dict[str, int]] = None,
+    budget: Optional[int] = None,
+) -> int:
+    total_done = 0
+    if per_user_count is None:
+        per_user_count = {}
+    if budget is None:
+        budget = MAX_PER_RUN
+
+    if BATCH_WRITES:
+        selected = select_candidates(normal_cands, promo_cands, repost_records, per_user_count, budget)
+        total_done = apply_writes_batched(client, me, selected, repost_records, like_records)
+    else:
+        reserve_for_promo = len(promo_cands)
+        normal_budget = max(0, budget - reserve_for_promo)
+
+        for c in normal_cands:
+            if total_done >= normal_budget or DEADLINE.expired():
+                break
+
+            ak = c.author_key
+            per_user_count.setdefault(ak, 0)
+
+            if per_user_count[ak] >= MAX_PER_USER:
+                continue
+
+            ok = repost_and_like(client, me, c.uri, c.cid, repost_records, like_records, force_refresh=False)
+            if ok:
+                total_done += 1
+                per_user_count[ak] += 1
+                log(f"✅ Repost+Like: {c.uri}")
+
+        for c in promo_cands:
+            if total_done >= budget or DEADLINE.expired():
+                break
+
+            ok = repost_and_like(client, me, c.uri, c.cid, repost_records, like_records, force_refresh=True)
+            if ok:
+                total_done += 1
+                log(f"✅ PROMO refresh repost+like: {c.uri}")
+
+    return total_done
+
+
 def main():
     log("=== BEAUTYGROUP BOT START ===")
+    run_once()
+
 
+def run_once(shared: Optional[Dict] = None) -> int:
+    """One polling run with the current module config; shared holds clients/caches across groups."""
     username = os.getenv(ENV_USERNAME, "").strip()
     password = os.getenv(ENV_PASSWORD, "").strip()
     if not username or not password:
         log(f"❌ Missing env {ENV_USERNAME} / {ENV_PASSWORD}")
-        return
+        return 0
 
+    STATS.reset()
+    DEADLINE.start(RUN_DEADLINE_MINUTES)
     cutoff = utcnow() - timedelta(hours=HOURS_BACK)
 
-    state = load_state(STATE_FILE)
-    repost_records: Dict[str, str] = state.get("repost_records", {})
-    like_records: Dict[str, str] = state.get("like_records", {})
+    # daemon mode houdt store + state open tussen runs
+    stores: Optional[Dict] = shared.get("stores") if shared is not None else None
+    with STATS.stage("load_state"):
+        if stores is not None and STATE_FILE in stores:
+            store, state = stores[STATE_FILE]
+        else:
+            store = open_state_store(STATE_FILE, STATE_BACKEND)
+            state = store.load()
+            if stores is not None:
+                stores[STATE_FILE] = (store, state)
+    repost_records: MutableMapping[str, str] = state["repost_records"]
+    like_records: MutableMapping[str, str] = state["like_records"]
+    if shared is not None:
+        shared_cache = shared.setdefault("resolve_cache", {})
+        shared_cache.update({k: v for k, v in state["resolve_cache"].items() if k not in shared_cache})
+        state["resolve_cache"] = shared_cache
+    resolve_cache: Dict[str, Dict] = state["resolve_cache"]
 
-    client = Client()
-    client.login(username, password)
-    me = client.me.did
-    log(f"✅ Logged in as {me}")
+    total_done = 0
+    excludes: Optional[Future] = None
+    try:
+        clients: Dict[str, Client] = shared.setdefault("clients", {}) if shared is not None else {}
+        client = clients.get(username.lower())
+        if client is None:
+            client = BotClient(shared["limiter"] if shared is not None else RateLimiter())
+            with STATS.stage("login"):
+                login_client(client, username, password, SESSION_FILE)
+            clients[username.lower()] = client
+        me = client.me.did
+        log(f"✅ Logged in as {me}")
+
+        with STATS.stage("reconcile"):
+            maybe_reconcile(client, me, state)
+
+        with STATS.stage("resolve"):
+            feed_uris, feed_chronological, list_uris, excl_uris = resolve_sources(client, resolve_cache)
+
+        # exclude lijsten laden op de achtergrond; bronnen halen alvast op en wachten pas bij het filteren
+        def load_excludes():
+            with STATS.stage("exclude"):
+                return load_exclude_sets(client, excl_uris, state["exclude_cache"], resolve_cache)
+
+        startup = ThreadPoolExecutor(max_workers=1, thread_name_prefix="exclude-load")
+        excludes = startup.submit(load_excludes)
+        startup.shutdown(wait=False)
+
+        ctx = {
+            "client": client,
+            "cutoff": cutoff,
+            "excludes": excludes,
+            "state": state,
+            "poll_budget": AUTHOR_POLL_BUDGET,
+            # watermarks die pas na de writes mogen bewegen: fn(repost_records)
+            "on_posted": [],
+        }
+
+        active_hashtags = [h.strip() for h in HASHTAGS if h.strip()]
+        log(f"Feeds: {len(feed_uris)} | Lists: {len(list_uris)} | Hashtags: {len(active_hashtags)}")
+
+        # promo bronnen eerst, zodat het promo-budget vaststaat voordat normale bronnen gelezen worden
+        sources: List[Iterator[Candidate]] = []
+        for key, note, furi in feed_uris:
+            if key == PROMO_FEED_KEY:
+                sources.append(
+                    timed_source(
+                        "feeds", f"feed:{key}", feed_source(ctx, key, note, furi, True, feed_chronological.get(key, FEED_CHRONOLOGICAL))
+                    )
+                )
+        for key, note, luri in list_uris:
+            if key == PROMO_LIST_KEY:
+                sources.append(timed_source("lists", f"list:{key}", list_source(ctx, key, note, luri, True)))
+        for key, note, furi in feed_uris:
+            if key != PROMO_FEED_KEY:
+                sources.append(
+                    timed_source(
+                        "feeds", f"feed:{key}", feed_source(ctx, key, note, furi, False, feed_chronological.get(key, FEED_CHRONOLOGICAL))
+                    )
+                )
+        for key, note, luri in list_uris:
+            if key != PROMO_LIST_KEY:
+                sources.append(timed_source("lists", f"list:{key}", list_source(ctx, key, note, luri, False)))
+        for query in active_hashtags:
+            sources.append(timed_source("hashtags", f"hashtag:{query}", hashtag_source(ctx, query)))
+
+        normal_cands, promo_cands = collect_candidates(sources, repost_records, EARLY_STOP, state["promo_seen"])
+
+        normal_cands.sort(key=lambda x: x.ts)
+        promo_cands.sort(key=lambda x: x.ts)
+
+        log(f"🧩 Candidates accepted: normal: {len(normal_cands)} | promo: {len(promo_cands)}")
+
+        with STATS.stage("writes"):
+            total_done = post_candidates(client, me, normal_cands, promo_cands, repost_records, like_records)
+        STATS.count("posted", total_done)
+        for settle in ctx["on_posted"]:
+            settle(repost_records)
+    finally:
+        # ook bij een fout of de deadline altijd opslaan en rapporteren
+        pruned = prune_state(state, utcnow() - timedelta(hours=max(HOURS_BACK, RECORD_RETENTION_HOURS)))
+        if pruned:
+            log(f"🧹 Pruned {pruned} old repost/like records")
+
+        with STATS.stage("save_state"):
+            if excludes is not None and excludes.exception() is None:
+                exclude_refresh = excludes.result()[2]
+                if exclude_refresh is not None:
+                    exclude_refresh.join()
+            store.save(state)
+            if stores is None:
+                store.close()
 
-    feed_uris: List[Tuple[str, str, str]] = []
-    for key, obj in FEEDS.items():
-        link = (obj.get("link") or "").strip()
-        note = (obj.get("note") or "").strip()
-        if not link:
-            continue
-        uri = normalize_feed_uri(client, link)
-        if uri:
-            feed_uris.append((key, note, uri))
-        else:
-            log(f"⚠️ Feed ongeldig (skip): {key} -> {link}")
+        try:
+            write_run_report(STATS.report(total_reposts=total_done), RUN_REPORT_FILE, PROMETHEUS_FILE)
+        except Exception as e:
+            log(f"⚠️ Could not write run report: {e}")
+    log(f"🔥 Done — total reposts this run: {total_done}")
+    return total_done
+
+
+# module settings die een groep in het config bestand mag zetten
+GROUP_KEYS = {
+    "feeds": "FEEDS",
+    "lijsten": "LIJSTEN",
+    "hashtags": "HASHTAGS",
+    "exclude_lists": "EXCLUDE_LISTS",
+    "promo_feed_key": "PROMO_FEED_KEY",
+    "promo_list_key": "PROMO_LIST_KEY",
+    "username_env": "ENV_USERNAME",
+    "password_env": "ENV_PASSWORD",
+    "state_file": "STATE_FILE",
+}
+# niet opgegeven bronnen zijn leeg in plaats van die van beautygroup; het account mag gedeeld worden
+GROUP_DEFAULTS = {
+    "feeds": {},
+    "lijsten": {},
+    "hashtags": [],
+    "exclude_lists": {},
+    "promo_feed_key": "",
+    "promo_list_key": "",
+}
 
-    list_uris: List[Tuple[str, str, str]] = []
-    for key, obj in LIJSTEN.items():
-        link = (obj.get("link") or "").strip()
-        note = (obj.get("note") or "").strip()
-        if not link:
-            continue
-        uri = normalize_list_uri(client, link)
-        if uri:
-            list_uris.append((key, note, uri))
-        else:
-            log(f"⚠️ Lijst ongeldig (skip): {key} -> {link}")
 
-    excl_uris: List[Tuple[str, str, str]] = []
-    for key, obj in EXCLUDE_LISTS.items():
-        link = (obj.get("link") or "").strip()
-        note = (obj.get("note") or "").strip()
-        if not link:
-            continue
-        uri = normalize_list_uri(client, link)
-        if uri:
-            excl_uris.append((key, note, uri))
-        else:
-            log(f"⚠️ Exclude lijst ongeldig (skip): {key} -> {link}")
+def group_settings(group: Dict) -> Dict:
+    """Module globals for one group: named keys, plus UPPERCASE overrides of existing settings.
+
+    Settings derived from others (HOURS_BACK, STATE_FILE) are computed again for the group.
+    """
+    settings: Dict = {}
+    for key, name in GROUP_KEYS.items():
+        if key in group:
+            settings[name] = group[key]
+        elif key in GROUP_DEFAULTS:
+            settings[name] = copy.deepcopy(GROUP_DEFAULTS[key])
+    for name, value in (group.get("settings") or {}).items():
+        current = globals().get(name)
+        if not name.isupper() or not isinstance(current, (bool, int, float, str)):
+            raise ValueError(f"unknown setting {name!r} in group {group.get('name')!r}")
+        if isinstance(current, bool) and not isinstance(value, bool):
+            value = str(value).strip().lower() not in ("0", "false", "no", "")
+        settings[name] = type(current)(value)
+    if not settings.get("STATE_FILE"):
+        raise ValueError(f"group {group.get('name')!r} needs its own state_file")
+    base = os.path.splitext(settings["STATE_FILE"])[0]
+    settings.setdefault("SESSION_FILE", "" if os.getenv("GITHUB_ACTIONS") else base + ".session")
+    settings.setdefault("RUN_REPORT_FILE", base + ".report.json")
+
+    # zelfde formules als bij de config bovenaan, met de HOURS_BACK van de groep
+    hours_back = settings.get("HOURS_BACK", HOURS_BACK)
+    reconcile_hours = settings.get("RECONCILE_HOURS", float(os.getenv("RECONCILE_HOURS", str(hours_back))))
+    settings["RECONCILE_HOURS"] = max(hours_back, reconcile_hours)
+    slack = settings.get("AUTHOR_POLL_SLACK_MINUTES", AUTHOR_POLL_SLACK_MINUTES)
+    gap = settings.get("AUTHOR_MAX_POLL_GAP_HOURS", float(os.getenv("AUTHOR_MAX_POLL_GAP_HOURS", str(hours_back))))
+    settings["AUTHOR_MAX_POLL_GAP_HOURS"] = max(0.0, min(gap, hours_back - slack / 60))
+    return settings
+
+
+def run_config(path: str, shared: Optional[Dict] = None) -> None:
+    """Run every group in a JSON config file, one after another in this process.
+
+    Groups logged in with the same account share a client; resolved URIs and
+    author feeds are shared, so members in several groups are fetched once.
+    """
+    global AUTHOR_FEED_CACHE
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    groups = config.get("groups") or []
+    log(f"=== CONFIG RUN: {len(groups)} group(s) from {path} ===")
+
+    if shared is None:
+        shared = {"limiter": RateLimiter()}
+    keys = set(GROUP_KEYS.values()) | {"SESSION_FILE", "RUN_REPORT_FILE", "RECONCILE_HOURS", "AUTHOR_MAX_POLL_GAP_HOURS"}
+    for group in groups:
+        keys.update(group.get("settings") or {})
+    defaults = {k: globals()[k] for k in keys if k in globals()}
+    AUTHOR_FEED_CACHE = {}
+    state_files: Set[str] = set()
+    try:
+        for group in groups:
+            name = group.get("name") or "?"
+            try:
+                settings = group_settings(group)
+            except ValueError as e:
+                log(f"❌ {e} (skip group)")
+                continue
+            # twee groepen in één state zouden elkaars records en watermarks overschrijven
+            state_path = os.path.abspath(settings["STATE_FILE"])
+            if state_path in state_files:
+                log(f"❌ Group {name} uses the state_file of another group (skip group)")
+                continue
+            state_files.add(state_path)
+            globals().update(defaults)
+            globals().update(settings)
+            log(f"=== GROUP {name} ===")
+            try:
+                run_once(shared)
+            except Exception:
+                import traceback
+                log(f"❌ Group {name} failed")
+                traceback.print_exc()
+    finally:
+        globals().update(defaults)
+        AUTHOR_FEED_CACHE = None
 
-    exclude_handles: Set[str] = set()
-    exclude_dids: Set[str] = set()
-    for key, note, luri in excl_uris:
-        log(f"🚫 Loading exclude list: {key} ({note})")
-        members = fetch_list_members(client, luri, limit=max(1000, LIST_MEMBER_LIMIT))
-        log(f"🚫 Exclude members: {len(members)}")
-        for h, d in members:
-            if h:
-                exclude_handles.add(h.lower())
-            if d:
-                exclude_dids.add(d.lower())
-
-    def promo_sort(item: Tuple[str, str, str], promo_key: str) -> int:
-        return 0 if item[0] == promo_key else 1
-
-    feed_uris.sort(key=lambda x: promo_sort(x, PROMO_FEED_KEY))
-    list_uris.sort(key=lambda x: promo_sort(x, PROMO_LIST_KEY))
-
-    all_candidates: List[Dict] = []
-
-    log(f"Feeds to process: {len(feed_uris)}")
-    for key, note, furi in feed_uris:
-        is_promo = key == PROMO_FEED_KEY
-        log(f"📥 Feed: {key} ({note})" + (" [PROMO]" if is_promo else ""))
-        items = fetch_feed_items(client, furi, max_items=FEED_MAX_ITEMS)
-        all_candidates.extend(
-            build_candidates_from_feed_items(items, cutoff, exclude_handles, exclude_dids, force_refresh=is_promo)
-        )
 
-    log(f"Lists to process: {len(list_uris)}")
-    for key, note, luri in list_uris:
-        is_promo = key == PROMO_LIST_KEY
-        log(f"📋 List: {key} ({note})" + (" [PROMO]" if is_promo else ""))
-        members = fetch_list_members(client, luri, limit=max(1000, LIST_MEMBER_LIMIT))
-        log(f"👥 Members fetched: {len(members)}")
+def run_daemon(config_path: str = "") -> None:
+    """Long-running polling mode: a run every DAEMON_INTERVAL_MINUTES in one process.
 
-        for (h, d) in members:
-            actor = d or h
-            if not actor:
-                continue
+    Clients, sessions and the loaded state (resolve/exclude caches, watermarks,
+    repost records) stay in memory between runs; state is still saved after
+    every run. SIGTERM/SIGINT finish the current run, writes included, then stop.
+    """
+    log(f"=== BEAUTYGROUP BOT DAEMON MODE (every {DAEMON_INTERVAL_MINUTES:g} min) ===")
+    stop = threading.Event()
 
-            author_items = fetch_author_feed(client, actor, AUTHOR_POSTS_PER_MEMBER)
-            cands = build_candidates_from_feed_items(
-                author_items, cutoff, exclude_handles, exclude_dids, force_refresh=is_promo
-            )
+    def on_signal(signum, frame):
+        log(f"🛑 Signal {signum}, stopping after this run")
+        stop.set()
 
-            if is_promo:
-                if cands:
-                    all_candidates.append(cands[-1])
-            else:
-                all_candidates.extend(cands)
-
-    active_hashtags = [h.strip() for h in HASHTAGS if h.strip()]
-    log(f"Hashtags to process: {len(active_hashtags)}")
-    for query in active_hashtags:
-        log(f"🔎 Hashtag search: {query}")
-        hashtag_posts = fetch_hashtag_posts(client, query, HASHTAG_MAX_ITEMS)
-        log(f"Hashtag posts fetched for {query}: {len(hashtag_posts)}")
-        all_candidates.extend(
-            build_candidates_from_postviews(hashtag_posts, cutoff, exclude_handles, exclude_dids)
-        )
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
 
-    seen: Set[str] = set()
-    deduped: List[Dict] = []
-    for c in all_candidates:
-        uri = c.get("uri")
-        if not uri:
-            continue
-        if uri in seen:
-            continue
-        seen.add(uri)
-        deduped.append(c)
+    shared: Dict = {"limiter": RateLimiter(), "stores": {}}
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                if config_path:
+                    run_config(config_path, shared)
+                else:
+                    run_once(shared)
+            except Exception:
+                import traceback
+                log("❌ Daemon run failed")
+                traceback.print_exc()
+            stop.wait(max(0.0, DAEMON_INTERVAL_MINUTES * 60 - (time.monotonic() - started)))
+    finally:
+        for store, state in shared["stores"].values():
+            try:
+                store.save(state)
+            finally:
+                store.close()
+        log("👋 Daemon stopped")
 
-    promo_cands = [c for c in deduped if c.get("force_refresh")]
-    normal_cands = [c for c in deduped if not c.get("force_refresh")]
 
-    normal_cands.sort(key=lambda x: x["created"])
-    promo_cands.sort(key=lambda x: x["created"])
+class AttrView:
+    """Attribute access over a raw record dict, so the model-based filters work on stream events."""
 
-    log(
-        f"🧩 Candidates total (deduped): {len(deduped)} | normal: {len(normal_cands)} | promo: {len(promo_cands)}"
-    )
+    def __init__(self, data: Dict):
+        self._data = data
 
-    total_done = 0
-    per_user_count: Dict[str, int] = {}
+    def __getattr__(self, name: str):
+        v = self._data.get(name)
+        return AttrView(v) if isinstance(v, dict) else v
 
-    reserve_for_promo = len(promo_cands)
-    normal_budget = max(0, MAX_PER_RUN - reserve_for_promo)
 
-    for c in normal_cands:
-        if total_done >= normal_budget:
-            break
+HASHTAG_RE = re.compile(r"#(\w+)")
 
-        ak = c["author_key"]
-        per_user_count.setdefault(ak, 0)
 
-        if per_user_count[ak] >= MAX_PER_USER:
-            continue
+def record_has_tag(record: Dict, tags: Set[str]) -> bool:
+    found = {t.lower() for t in HASHTAG_RE.findall(record.get("text") or "")}
+    for facet in record.get("facets") or []:
+        for feature in facet.get("features") or []:
+            if feature.get("$type") == "app.bsky.richtext.facet#tag" and feature.get("tag"):
+                found.add(feature["tag"].lower())
+    return bool(found & tags)
 
-        ok = repost_and_like(client, me, c["uri"], c["cid"], repost_records, like_records, force_refresh=False)
-        if ok:
-            total_done += 1
-            per_user_count[ak] += 1
-            log(f"✅ Repost+Like: {c['uri']}")
-            time.sleep(SLEEP_SECONDS)
 
-    for c in promo_cands:
-        if total_done >= MAX_PER_RUN:
-            break
+def stream_candidate(event: Dict, member_dids: Set[str], tags: Set[str], exclude_dids: Set[str]) -> Optional[Candidate]:
+    """Candidate for a Jetstream post create event, None when it does not pass the filters."""
+    if event.get("kind") != "commit":
+        return None
+    commit = event.get("commit") or {}
+    if commit.get("operation") != "create" or commit.get("collection") != "app.bsky.feed.post":
+        return None
+    did = (event.get("did") or "").lower()
+    record = commit.get("record") or {}
+    if not did or did in exclude_dids:
+        return None
+    if did not in member_dids and not (tags and record_has_tag(record, tags)):
+        return None
 
-        ok = repost_and_like(client, me, c["uri"], c["cid"], repost_records, like_records, force_refresh=True)
-        if ok:
-            total_done += 1
-            log(f"✅ PROMO refresh repost+like: {c['uri']}")
-            time.sleep(SLEEP_SECONDS)
+    rec = AttrView(record)
+    if rec.reply or is_quote_post(rec) or not has_media(rec):
+        return None
 
-    state["repost_records"] = repost_records
-    state["like_records"] = like_records
-    save_state(STATE_FILE, state)
-    log(f"🔥 Done — total reposts this run: {total_done}")
+    cid = commit.get("cid")
+    rkey = commit.get("rkey")
+    if not cid or not rkey:
+        return None
+    uri = f"at://{event['did']}/app.bsky.feed.post/{rkey}"
+    return Candidate(uri, cid, event.get("time_us", 0) / 1_000_000, did, False)
+
+
+def jetstream_url(base: str, dids: Set[str], cursor: Optional[int]) -> str:
+    params: List[Tuple[str, str]] = [("wantedCollections", "app.bsky.feed.post")]
+    params.extend(("wantedDids", d) for d in sorted(dids))
+    if cursor:
+        params.append(("cursor", str(cursor)))
+    return base + "?" + urlencode(params)
+
+
+def run_stream():
+    """Long-running mode: follow Jetstream and repost matching posts every STREAM_FLUSH_SECONDS.
+
+    MAX_PER_RUN and MAX_PER_USER count per STREAM_WINDOW_MINUTES; candidates over the caps wait
+    for a later window until they pass the cutoff. List members and exclude lists are reloaded
+    every EXCLUDE_REFRESH_HOURS. Promo feed/list refreshes stay in the polling mode.
+    """
+    log("=== BEAUTYGROUP BOT STREAM MODE ===")
+    try:
+        from websockets.sync.client import connect
+    except ImportError:
+        log("❌ Stream mode needs the websockets package (pip install websockets)")
+        return
+
+    username = os.getenv(ENV_USERNAME, "").strip()
+    password = os.getenv(ENV_PASSWORD, "").strip()
+    if not username or not password:
+        log(f"❌ Missing env {ENV_USERNAME} / {ENV_PASSWORD}")
+        return
+
+    store = open_state_store(STATE_FILE, STATE_BACKEND)
+    state = store.load()
+    repost_records: MutableMapping[str, str] = state["repost_records"]
+    like_records: MutableMapping[str, str] = state["like_records"]
+
+    client = BotClient(RateLimiter())
+    login_client(client, username, password, SESSION_FILE)
+    me = client.me.did
+    log(f"✅ Logged in as {me}")
+    maybe_reconcile(client, me, state)
+
+    _, _, list_uris, excl_uris = resolve_sources(client, state["resolve_cache"])
+
+    def load_excludes() -> Set[str]:
+        """Exclude DIDs, waiting for a stale-list refresh so the set holds the new members."""
+        _, dids, refresh = load_exclude_sets(client, excl_uris, state["exclude_cache"], state["resolve_cache"])
+        if refresh is None:
+            return dids
+        refresh.join()
+        cache = state["exclude_cache"]
+        return {d for _, _, luri in excl_uris for d in cache.get(luri, {}).get("dids", [])}
+
+    def load_members(partial_ok: bool) -> Optional[Set[str]]:
+        """Member DIDs of all lists; None when a list failed and partial_ok is False."""
+        dids: Set[str] = set()
+        for key, note, luri in list_uris:
+            members = fetch_list_members(client, luri, limit=max(1000, LIST_MEMBER_LIMIT), partial_ok=partial_ok)
+            if members is None:
+                return None
+            dids.update(d for _, d in members if d)
+        return dids
+
+    tags = {h.strip().lstrip("#").lower() for h in HASHTAGS if h.strip()}
+
+    def wanted_dids(members: Set[str]) -> Set[str]:
+        # met hashtags moeten alle posts binnenkomen; anders filtert Jetstream zelf op DID
+        return members if not tags and len(members) <= JETSTREAM_MAX_DIDS else set()
+
+    exclude_dids = load_excludes()
+    member_dids = load_members(partial_ok=True) or set()
+    refreshed_at = time.monotonic()
+    log(f"👥 Stream members: {len(member_dids)} | hashtags: {len(tags)}")
+    wanted = wanted_dids(member_dids)
+
+    stop = threading.Event()
+
+    def on_signal(signum, frame):
+        log(f"🛑 Signal {signum}, stopping after flush")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    # niet gekozen kandidaten blijven staan tot ze buiten de cutoff vallen
+    pending: Dict[str, Candidate] = {}
+    last_flush = time.monotonic()
+    total_done = 0
+    window_start = time.monotonic()
+    window_done = 0
+    window_users: Dict[str, int] = {}
+
+    def flush():
+        nonlocal total_done, last_flush, window_start, window_done, window_users
+        last_flush = time.monotonic()
+        if last_flush - window_start >= STREAM_WINDOW_MINUTES * 60:
+            window_start, window_done, window_users = last_flush, 0, {}
+        cutoff_ts = (utcnow() - timedelta(hours=HOURS_BACK)).timestamp()
+        for uri in [u for u, c in pending.items() if c.ts < cutoff_ts or u in repost_records]:
+            pending.pop(uri)
+        if pending and window_done < MAX_PER_RUN:
+            normal = sorted(pending.values(), key=lambda x: x.ts)
+            done = post_candidates(
+                client, me, normal, [], repost_records, like_records, window_users, MAX_PER_RUN - window_done
+            )
+            for uri in [u for u in pending if u in repost_records]:
+                pending.pop(uri)
+            window_done += done
+            total_done += done
+            log(f"📤 Stream flush: {done} reposts ({total_done} total, {len(pending)} waiting)")
+        prune_state(state, utcnow() - timedelta(hours=max(HOURS_BACK, RECORD_RETENTION_HOURS)))
+        store.save(state)
+
+    attempt = 0
+    while not stop.is_set():
+        cursor = state.get("jetstream_cursor")
+        # paar seconden terugspoelen na een reconnect, dubbele events vallen weg op uri
+        url = jetstream_url(JETSTREAM_URL, wanted, int(cursor) - 5_000_000 if cursor else None)
+        try:
+            with connect(url, open_timeout=30, max_size=None) as ws:
+                log("🔌 Jetstream connected")
+                attempt = 0
+                while not stop.is_set():
+                    try:
+                        msg = ws.recv(timeout=1)
+                    except TimeoutError:
+                        msg = None
+                    if msg:
+                        event = json.loads(msg)
+                        if event.get("time_us"):
+                            state["jetstream_cursor"] = event["time_us"]
+                        c = stream_candidate(event, member_dids, tags, exclude_dids)
+                        if c and c.uri not in repost_records:
+                            pending[c.uri] = c
+                    if time.monotonic() - last_flush >= STREAM_FLUSH_SECONDS:
+                        flush()
+                    if time.monotonic() - refreshed_at >= EXCLUDE_REFRESH_HOURS * 3600:
+                        exclude_dids = load_excludes()
+                        refreshed_at = time.monotonic()
+                        members = load_members(partial_ok=False)
+                        if members is not None and members != member_dids:
+                            member_dids = members
+                            log(f"👥 Stream members changed: {len(member_dids)}")
+                            if wanted_dids(member_dids) != wanted:
+                                # Jetstream filtert op de DIDs uit de URL: opnieuw verbinden
+                                wanted = wanted_dids(member_dids)
+                                break
+        except Exception as e:
+            if stop.is_set():
+                break
+            wait = min(60, 2 ** attempt)
+            attempt += 1
+            log(f"⚠️ Jetstream connection lost: {e} — reconnect in {wait}s")
+            stop.wait(wait)
+
+    flush()
+    store.close()
+    log(f"🔥 Stream stopped — total reposts: {total_done}")
 
 
 if __name__ == "__main__":
     try:
         print("=== ABOUT TO CALL MAIN ===", flush=True)
-        main()
+        args = sys.argv[1:]
+        if "--config" in args[:-1]:
+            CONFIG_FILE = args[args.index("--config") + 1]
+        if "--stream" in args or RUN_MODE == "stream":
+            run_stream()
+        elif "--daemon" in args or RUN_MODE == "daemon":
+            run_daemon(CONFIG_FILE)
+        elif CONFIG_FILE:
+            run_config(CONFIG_FILE)
+        else:
+            main()
     except Exception:
         import traceback
         print("=== FATAL ERROR ===", flush=True)
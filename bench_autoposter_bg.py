@@ -0,0 +1,363 @@
+"""Offline benchmark for autoposter_bg.main() with a fake Bluesky server.
+
+Runs main() with the bot's real BotClient (rate limiter, retries, timeouts, call
+stats) and atproto's real Request and models; only the HTTP transport is fake
+and answers XRPC calls with synthetic lists, feeds and hashtag results. Reports
+wall time, API calls per endpoint, retries and peak memory.
+
+    python bench_autoposter_bg.py
+    python bench_autoposter_bg.py --members 100,1500,20000 --latency-ms 20 --error-rate 0.01 --runs 2
+    python bench_autoposter_bg.py --read-rate 1000 --json bench_output.txt
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import httpx
+from atproto import Request
+
+import autoposter_bg as bot
+
+
+def _h(s: str) -> int:
+    return int(hashlib.blake2b(s.encode(), digest_size=8).hexdigest(), 16)
+
+
+def iso(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def fake_jwt(did: str, scope: str) -> str:
+    """Unsigned JWT with an exp two hours ahead; the client only reads the payload."""
+    def part(obj: Dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+
+    now = int(time.time())
+    return f"{part({'alg': 'ES256K', 'typ': 'JWT'})}.{part({'sub': did, 'scope': scope, 'iat': now, 'exp': now + 7200})}.sig"
+
+
+def profile(did: str) -> Dict:
+    return {"did": did, "handle": did.split(":")[-1] + ".bsky.social"}
+
+
+class FakeServer:
+    """Answers the XRPC calls autoposter_bg makes, as an httpx transport handler.
+
+    Every member posts deterministically (hash of DID + run), a share of them
+    inside the HOURS_BACK window; `active_share` sets that share.
+    """
+
+    def __init__(
+        self,
+        members: int,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        active_share: float = 0.1,
+        feed_size: int = 500,
+        hashtag_size: int = 200,
+        run: int = 0,
+        seed: int = 1,
+    ):
+        self.members = [f"did:plc:bench{i:06d}" for i in range(members)]
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.active_share = active_share
+        self.feed_size = feed_size
+        self.hashtag_size = hashtag_size
+        self.run = run
+        self.rng = random.Random(seed)
+        self.now = datetime.now(timezone.utc)
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.me = "did:plc:benchbot"
+        self.routes = {
+            "com.atproto.server.createSession": self.create_session,
+            "app.bsky.actor.getProfile": self.get_profile,
+            "app.bsky.actor.getProfiles": self.get_profiles,
+            "app.bsky.feed.getFeed": self.get_feed,
+            "app.bsky.feed.getListFeed": self.get_list_feed,
+            "app.bsky.feed.getAuthorFeed": self.get_author_feed,
+            "app.bsky.feed.searchPosts": self.search_posts,
+            "app.bsky.graph.getList": self.get_list,
+            "com.atproto.identity.resolveHandle": self.resolve_handle,
+            "com.atproto.repo.createRecord": self.create_record,
+            "com.atproto.repo.deleteRecord": self.delete_record,
+            "com.atproto.repo.applyWrites": self.apply_writes,
+            "com.atproto.repo.listRecords": self.list_records,
+        }
+
+    # -- plumbing ---------------------------------------------------------
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        nsid = request.url.path.rsplit("/", 1)[-1]
+        name = nsid.rsplit(".", 1)[-1]
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            roll = self.rng.random()
+            timeout = roll < self.timeout_rate
+            fail = not timeout and roll < self.timeout_rate + self.error_rate
+            if timeout or fail:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if timeout:
+            raise httpx.ReadTimeout("fake timeout", request=request)
+        if fail:
+            return httpx.Response(500, json={"error": "InternalServerError", "message": "fake HTTP 500"})
+        route = self.routes.get(nsid)
+        if route is None:
+            return httpx.Response(501, json={"error": "MethodNotImplemented", "message": nsid})
+        body = json.loads(request.content) if request.content else {}
+        return httpx.Response(200, json=route(request.url.params, body))
+
+    # -- synthetic data ---------------------------------------------------
+
+    def _post(self, did: str, n: int, age: timedelta, tag: bool = False) -> Dict:
+        created = iso(self.now - age)
+        h = _h(f"{did}/{n}")
+        record = {"$type": "app.bsky.feed.post", "text": "#bskypromo" if tag else "post", "createdAt": created}
+        if h % 10 != 0:  # anders tekst-only
+            blob = {"$type": "blob", "ref": {"$link": f"bafkrei{h:x}"}, "mimeType": "image/jpeg", "size": 1000}
+            record["embed"] = {"$type": "app.bsky.embed.images", "images": [{"image": blob, "alt": ""}]}
+        uri = f"at://{did}/app.bsky.feed.post/{n:013d}"
+        if h % 7 == 0:
+            ref = {"uri": uri, "cid": f"bafy{h:x}"}
+            record["reply"] = {"root": ref, "parent": ref}
+        return {"uri": uri, "cid": f"bafy{h:x}", "author": profile(did), "record": record, "indexedAt": created}
+
+    def _member_posts(self, did: str, limit: int) -> List[Dict]:
+        h = _h(f"{did}#{self.run}")
+        active = (h % 1000) / 1000.0 < self.active_share
+        first_age = timedelta(minutes=(h % 90) if active else 300 + (h % 5000))
+        return [
+            {"post": self._post(did, (h % 100000) * 100 + j, first_age + timedelta(hours=6 * j))}
+            for j in range(limit)
+        ]
+
+    def _page(self, params) -> int:
+        return int(params.get("cursor") or 0)
+
+    def _limit(self, params, default: int = 50) -> int:
+        return int(params.get("limit") or default)
+
+    # -- endpoints --------------------------------------------------------
+
+    def create_session(self, params, body):
+        return {
+            "accessJwt": fake_jwt(self.me, "com.atproto.access"),
+            "refreshJwt": fake_jwt(self.me, "com.atproto.refresh"),
+            "did": self.me,
+            "handle": "bench.bsky.social",
+        }
+
+    def get_profile(self, params, body):
+        return profile(self.me)
+
+    def get_profiles(self, params, body):
+        profiles = []
+        for a in params.get_list("actors"):
+            h = _h(f"{a}#{self.run}")
+            active = (h % 1000) / 1000.0 < self.active_share
+            profiles.append(dict(profile(a), postsCount=(_h(a) % 5000) + (self.run if active else 0)))
+        return {"profiles": profiles}
+
+    def get_list(self, params, body):
+        start = self._page(params)
+        limit = self._limit(params)
+        uri = params["list"]
+        subset = self.members[::50] if "exclude" in uri else self.members
+        page = subset[start:start + limit]
+        view = {
+            "uri": uri,
+            "cid": f"bafylist{_h(uri):x}",
+            "name": uri.rsplit("/", 1)[-1],
+            "purpose": "app.bsky.graph.defs#curatelist",
+            "creator": profile("did:plc:benchlists"),
+            "indexedAt": iso(self.now),
+        }
+        items = [{"uri": f"{uri}item/{d}", "subject": profile(d)} for d in page]
+        out = {"list": view, "items": items}
+        if start + limit < len(subset):
+            out["cursor"] = str(start + limit)
+        return out
+
+    def get_author_feed(self, params, body):
+        return {"feed": self._member_posts(params["actor"], self._limit(params))}
+
+    def get_feed(self, params, body):
+        start = self._page(params)
+        end = min(start + self._limit(params), self.feed_size)
+        feed = []
+        for i in range(start, end):
+            did = self.members[_h(f"feed{i}") % len(self.members)] if self.members else "did:plc:x"
+            feed.append({"post": self._post(did, 10_000_000 + i, timedelta(minutes=3 * i))})
+        out = {"feed": feed}
+        if end < self.feed_size:
+            out["cursor"] = str(end)
+        return out
+
+    def get_list_feed(self, params, body):
+        start = self._page(params)
+        active = [d for d in self.members if (_h(f"{d}#{self.run}") % 1000) / 1000.0 < self.active_share]
+        end = min(start + self._limit(params), len(active))
+        feed = [
+            {"post": self._post(d, 20_000_000 + i, timedelta(minutes=(_h(d) % 90) + i // 10))}
+            for i, d in enumerate(active[start:end], start)
+        ]
+        out = {"feed": feed}
+        if end < len(active):
+            out["cursor"] = str(end)
+        return out
+
+    def search_posts(self, params, body):
+        start = self._page(params)
+        size = self.hashtag_size
+        if params.get("since"):
+            # alleen posts vanaf since, zoals de echte search
+            since = datetime.fromisoformat(params["since"].replace("Z", "+00:00"))
+            size = min(size, max(0, int((self.now - since).total_seconds() // 60) + 1))
+        end = min(start + self._limit(params, 25), size)
+        posts = [
+            self._post(self.members[_h(f"tag{i}") % len(self.members)], 30_000_000 + i, timedelta(minutes=i), tag=True)
+            for i in range(start, end)
+        ]
+        out = {"posts": posts}
+        if end < size:
+            out["cursor"] = str(end)
+        return out
+
+    def resolve_handle(self, params, body):
+        return {"did": f"did:plc:{_h(params['handle']):x}"}
+
+    def create_record(self, params, body):
+        uri = f"at://{body['repo']}/{body['collection']}/{bot.next_tid()}"
+        return {"uri": uri, "cid": f"bafyrec{_h(uri):x}"}
+
+    def delete_record(self, params, body):
+        return {}
+
+    def apply_writes(self, params, body):
+        return {}
+
+    def list_records(self, params, body):
+        return {"records": []}
+
+
+class BenchClient(bot.BotClient):
+    """The bot's own BotClient, with requests going to `server` instead of the network."""
+
+    server: FakeServer
+
+    def __init__(self, limiter, *args, **kwargs):
+        kwargs["request"] = Request(
+            timeout=bot.REQUEST_TIMEOUT_SECONDS or None, transport=httpx.MockTransport(self.server.handle)
+        )
+        super().__init__(limiter, *args, **kwargs)
+
+
+def configure(members: int, feeds: int, hashtags: int, state_dir: str) -> None:
+    bot.LIST_MEMBER_LIMIT = members
+    bot.STATE_FILE = os.path.join(state_dir, "state.json")
+    bot.RUN_REPORT_FILE = os.path.join(state_dir, "report.json")
+    bot.PROMETHEUS_FILE = ""
+    bot.SESSION_FILE = ""
+    # shard workers starten een schone interpreter zonder de fake server
+    bot.LIST_WORKER_PROCESSES = 1
+    bot.FEEDS = {
+        f"feed {i + 1}": {"link": f"at://did:plc:benchfeeds/app.bsky.feed.generator/f{i}", "note": ""}
+        for i in range(feeds)
+    }
+    bot.LIJSTEN = {"lijst 2": {"link": "at://did:plc:benchlists/app.bsky.graph.list/members", "note": ""}}
+    bot.EXCLUDE_LISTS = {"exclude 1": {"link": "at://did:plc:benchlists/app.bsky.graph.list/exclude", "note": ""}}
+    bot.HASHTAGS = [f"#benchtag{i}" for i in range(hashtags)]
+    os.environ.setdefault(bot.ENV_USERNAME, "bench")
+    os.environ.setdefault(bot.ENV_PASSWORD, "bench")
+
+
+def run_scenario(members: int, args) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as state_dir:
+        configure(members, args.feeds, args.hashtags, state_dir)
+        for run in range(args.runs):
+            fake = FakeServer(
+                members,
+                latency_ms=args.latency_ms,
+                error_rate=args.error_rate,
+                timeout_rate=args.timeout_rate,
+                active_share=args.active_share,
+                run=run,
+                seed=args.seed + run,
+            )
+            BenchClient.server = fake
+            bot.BotClient = BenchClient
+            bot.log = (lambda msg: None) if args.quiet else bot.log
+
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            bot.main()
+            wall = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results.append(
+                {
+                    "members": members,
+                    "run": run + 1,
+                    "wall_s": round(wall, 3),
+                    "peak_mb": round(peak / 1024 / 1024, 2),
+                    "api_calls": sum(fake.calls.values()),
+                    "calls": dict(sorted(fake.calls.items())),
+                    "errors": dict(sorted(fake.errors.items())),
+                    "retries": sum(bot.STATS.retries.values()),
+                    "stages_s": {k: round(v, 3) for k, v in bot.STATS.stages.items()},
+                    "funnel": dict(sorted(bot.STATS.funnel.items())),
+                }
+            )
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--members", default="100,1000,5000", help="comma separated list sizes")
+    ap.add_argument("--feeds", type=int, default=3)
+    ap.add_argument("--hashtags", type=int, default=1)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per API call")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of API calls that answer HTTP 500")
+    ap.add_argument("--timeout-rate", type=float, default=0.0, help="share of API calls that time out")
+    ap.add_argument("--read-rate", type=float, help="read calls per second for the limiter (default: READ_RATE)")
+    ap.add_argument("--active-share", type=float, default=0.1, help="share of members with a post in the window")
+    ap.add_argument("--runs", type=int, default=1, help="consecutive runs per scenario (state is kept)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="also write results as JSON to this file")
+    ap.add_argument("--verbose", dest="quiet", action="store_false", help="keep the bot's log output")
+    args = ap.parse_args()
+    if args.read_rate:
+        bot.READ_RATE = args.read_rate
+
+    all_results: List[Dict] = []
+    print(f"{'members':>8} {'run':>4} {'wall_s':>9} {'peak_mb':>8} {'calls':>7} {'retries':>7}  per endpoint")
+    for members in [int(m) for m in args.members.split(",") if m.strip()]:
+        for r in run_scenario(members, args):
+            all_results.append(r)
+            per = " ".join(f"{k}={v}" for k, v in r["calls"].items())
+            print(f"{r['members']:>8} {r['run']:>4} {r['wall_s']:>9.3f} {r['peak_mb']:>8.2f} {r['api_calls']:>7} {r['retries']:>7}  {per}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()